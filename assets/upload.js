@@ -0,0 +1,72 @@
+// ============================================================================
+// SUBIDA DE ARCHIVOS GPS (página Cargar Datos)
+// ============================================================================
+// El botón 'upload-btn' abre un selector de archivos (se pueden elegir varios). Los archivos
+// se envían juntos por multipart/form-data a /api/upload (sin pasar por los callbacks de Dash),
+// que los procesa como un único lote, mostrando el porcentaje enviado en el botón. La respuesta
+// ({job_id} o {error}) se escribe en el input oculto 'upload-job-id' para que los callbacks sigan el trabajo.
+// Se usan eventos delegados porque el layout de la página se renderiza después de cargar el script.
+
+(function () {
+    function notificarDash(respuesta) {
+        var input = document.getElementById('upload-job-id');
+        if (!input) {
+            return;
+        }
+        // React solo detecta el cambio si el valor se asigna con el setter nativo
+        var setter = Object.getOwnPropertyDescriptor(window.HTMLInputElement.prototype, 'value').set;
+        setter.call(input, JSON.stringify(respuesta));
+        input.dispatchEvent(new Event('input', { bubbles: true }));
+    }
+
+    function subirArchivos(archivos) {
+        var boton = document.getElementById('upload-btn');
+        var datos = new FormData();
+        for (var i = 0; i < archivos.length; i++) {
+            datos.append('file', archivos[i], archivos[i].name);
+        }
+
+        var peticion = new XMLHttpRequest();
+        peticion.open('POST', '/api/upload');
+        peticion.upload.onprogress = function (evento) {
+            if (boton && evento.lengthComputable) {
+                boton.textContent = 'Upload ' + Math.round(100 * evento.loaded / evento.total) + '%';
+            }
+        };
+        peticion.onloadend = function () {
+            if (boton) {
+                boton.textContent = 'Upload';
+                boton.disabled = false;
+            }
+            var respuesta;
+            try {
+                respuesta = JSON.parse(peticion.responseText);
+            } catch (e) {
+                respuesta = { error: 'Error al subir el archivo (' + (peticion.status || 'sin conexión') + ').' };
+            }
+            // Marca de tiempo para que dos respuestas iguales también disparen el callback
+            respuesta.enviado = Date.now();
+            notificarDash(respuesta);
+        };
+        if (boton) {
+            boton.disabled = true;
+        }
+        peticion.send(datos);
+    }
+
+    document.addEventListener('click', function (evento) {
+        if (evento.target && evento.target.id === 'upload-btn') {
+            // Selector de archivos creado en cada clic (html de Dash no tiene <input type="file">)
+            var selector = document.createElement('input');
+            selector.type = 'file';
+            selector.accept = '.xlsx';
+            selector.multiple = true;
+            selector.addEventListener('change', function () {
+                if (selector.files.length > 0) {
+                    subirArchivos(selector.files);
+                }
+            });
+            selector.click();
+        }
+    });
+})();
@@ -0,0 +1,131 @@
+"""
+Generador de temporadas sintéticas con el mismo esquema que los Excel GPS reales.
+
+Cada fila es un drill (Selection = 'Drills') o el total de la sesión (Selection = 'Session')
+de un jugador en un día, con las columnas que usan las estadísticas y la Session Report.
+Además incluye filas 'TEAM' y algunos jugadores en 'Rehab', que el pipeline descarta.
+
+Una temporada real (escala 1) es un equipo de 30 jugadores, 44 semanas de 6 días y 8 drills por sesión.
+
+Uso:
+    python -m benchmarks.generador salida.parquet [--equipos N] [--semanas N] [--jugadores N] [--drills N]
+"""
+import argparse
+import datetime
+
+import numpy as np
+import polars as pl
+
+
+POSICIONES = ['Central', 'Lateral', 'Centrocampista', 'Extremo', 'Delantero']
+
+# Match Day de cada día de entrenamiento de una semana tipo (lunes a sábado)
+SEMANA_TIPO = ['+1 MD', '-4 MD', '-3 MD', '-2 MD', '-1 MD', 'MD']
+
+ZONAS_VELOCIDAD = ['Speed Zones (m) [0.0, 45.0]% (m)', 'Speed Zones (m) [45.0, 65.0]% (m)',
+                   'Speed Zones (m) [65.0, 75.0]% (m)', 'Speed Zones (m) [75.0, 85.0]% (m)',
+                   'Speed Zones (m) [85.0, 95.0]% (m)', 'Speed Zones (m) [95.0, 100.0]% (m)']
+ZONAS_ACELERACION = ['Acceleration Zones  [0, 50]% Cnt', 'Acceleration Zones  [50, 60]% Cnt',
+                     'Acceleration Zones  [-50, 0]% Cnt', 'Acceleration Zones  [-60, -50]% Cnt']
+
+# Semanas que cubre cada archivo subido (los reales son bimestrales, "dd_mm_aaaa_al_dd_mm_aaaa.xlsx")
+SEMANAS_POR_ARCHIVO = 9
+
+
+def generar_temporada(equipos=1, semanas=44, jugadores=30, drills=8, semilla=0,
+                      inicio=datetime.date(2023, 7, 3)):
+    """
+    Genera una temporada sintética (DataFrame) con una fila por jugador, día y drill,
+    más la fila 'Session' de cada jugador y día. La columna 'File Name' agrupa las semanas
+    en archivos de SEMANAS_POR_ARCHIVO semanas.
+    """
+    rng = np.random.default_rng(semilla)
+    dias = len(SEMANA_TIPO)
+    filas_por_dia = drills + 1  # drills + total de la sesión
+
+    # Índices de cada fila: equipo, semana, día, jugador y drill (el último es la sesión)
+    forma = (equipos, semanas, dias, jugadores, filas_por_dia)
+    equipo, semana, dia, jugador, drill = (indice.ravel() for indice in np.indices(forma))
+    n = equipo.size
+    es_sesion = drill == drills
+
+    # Duración en minutos: cada drill entre 8 y 25 minutos, la sesión la suma aproximada
+    minutos = rng.uniform(8, 25, n)
+    minutos[es_sesion] *= drills
+
+    fechas = np.array([inicio + datetime.timedelta(days=7 * s + d) for s in range(semanas) for d in range(dias)])
+    archivo = semana // SEMANAS_POR_ARCHIVO
+    nombres_archivo = []
+    for a in range(archivo.max() + 1):
+        primera = fechas[a * SEMANAS_POR_ARCHIVO * dias]
+        ultima = fechas[min((a + 1) * SEMANAS_POR_ARCHIVO, semanas) * dias - 1]
+        nombres_archivo.append(f"{primera:%d_%m_%Y}_al_{ultima:%d_%m_%Y}.xlsx")
+
+    distancia = minutos * rng.normal(90, 15, n).clip(20)
+    hsr = distancia * rng.uniform(0.03, 0.10, n)
+    sprint = hsr * rng.uniform(0.1, 0.4, n)
+    aceleraciones = rng.poisson(minutos * 0.8)
+    deceleraciones = rng.poisson(minutos * 0.8)
+    reparto_velocidad = rng.dirichlet([8, 5, 3, 2, 1, 0.5], n)
+
+    df = pl.DataFrame({
+        'Player': pl.select(pl.format('Jugador {}-{}', pl.Series(equipo + 1), pl.Series(jugador + 1))).to_series(),
+        'Position': np.array(POSICIONES)[jugador % len(POSICIONES)],
+        'Team ': np.where(equipo == 0, 'Real Sporting', np.char.add('Equipo ', (equipo + 1).astype(str))),
+        'Match Day': np.array(SEMANA_TIPO)[dia],
+        'Week Team': np.char.add('S', np.char.zfill((semana + 1).astype(str), 2)),
+        'Selection': np.where(es_sesion, 'Session', 'Drills'),
+        'Date': np.array([f"{f:%d/%m/%Y}" for f in fechas])[semana * dias + dia],
+        'Drills Duration': (minutos * 60).astype(np.int64),
+        'Distance (m)': distancia,
+        'Speed Zones (m) [0.0, 6.0]km/h (m)': distancia * rng.uniform(0.15, 0.3, n),
+        'Abs HSR(m)': hsr,
+        'Rel HSR(m)': hsr * rng.uniform(0.9, 1.3, n),
+        'Sprint Abs (m)': sprint,
+        'Sprint Rel (m)': sprint * rng.uniform(0.9, 1.3, n),
+        'Explosive Dist (m)': distancia * rng.uniform(0.01, 0.05, n),
+        'MAX Speed(km/h)': rng.normal(28, 3, n).clip(10),
+        'Max Acceleration': rng.normal(3.5, 0.6, n).clip(0.5),
+        'Accelerations': aceleraciones,
+        'Decelerations': deceleraciones,
+        'Dif. ACC/DEC': aceleraciones - deceleraciones,
+        'Step Balance (%)': rng.normal(50, 3, n),
+        'Total impacts': rng.poisson(minutos * 4),
+        **{col: distancia * reparto_velocidad[:, i] for i, col in enumerate(ZONAS_VELOCIDAD)},
+        **{col: rng.poisson(minutos * tasa) for col, tasa in zip(ZONAS_ACELERACION, [0.5, 0.2, 0.5, 0.2])},
+        'File Name': np.array(nombres_archivo)[archivo],
+    })
+
+    # Duración en formato hh:mm:ss, algunos jugadores en Rehab cada día y una fila TEAM por día
+    segundos = pl.col('Drills Duration')
+    df = df.with_columns(
+        pl.format('{}:{}:{}',
+                  (segundos // 3600).cast(pl.String).str.zfill(2),
+                  (segundos % 3600 // 60).cast(pl.String).str.zfill(2),
+                  (segundos % 60).cast(pl.String).str.zfill(2)).alias('Drills Duration'),
+        pl.when(pl.Series(rng.random(n) < 0.03)).then(pl.lit('Rehab')).otherwise(pl.col('Match Day')).alias('Match Day'),
+    )
+    filas_team = (df.filter(pl.col('Selection') == 'Session')
+                    .unique(['Team ', 'Date'], keep='first', maintain_order=True)
+                    .with_columns(pl.lit('TEAM').alias('Player')))
+    return pl.concat([df, filas_team]).sort(pl.col('Date').str.to_date('%d/%m/%Y'), maintain_order=True)
+
+def archivos_temporada(df):
+    """Divide una temporada generada en los archivos que se subirían (lista de (nombre, DataFrame) por fecha)"""
+    return [(df_archivo['File Name'][0], df_archivo)
+            for df_archivo in df.sort(pl.col('Date').str.to_date('%d/%m/%Y'), maintain_order=True)
+                                .partition_by('File Name', maintain_order=True)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Genera una temporada GPS sintética en formato Parquet")
+    parser.add_argument('salida', help="Ruta del parquet de salida")
+    parser.add_argument('--equipos', type=int, default=1)
+    parser.add_argument('--semanas', type=int, default=44)
+    parser.add_argument('--jugadores', type=int, default=30)
+    parser.add_argument('--drills', type=int, default=8)
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+    df = generar_temporada(args.equipos, args.semanas, args.jugadores, args.drills, args.semilla)
+    df.write_parquet(args.salida)
+    print(f"{df.height} filas, {df['File Name'].n_unique()} archivos -> {args.salida}")
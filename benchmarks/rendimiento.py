@@ -0,0 +1,155 @@
+"""
+Benchmark del pipeline de estadísticas con temporadas sintéticas (benchmarks/generador.py).
+
+Para cada escala (1 = una temporada real, 10 y 100 = 10 y 100 equipos) genera los datos
+en una carpeta temporal y mide latencia y pico de memoria de cada etapa:
+
+    calcular_estadisticas          estadísticas de temporada de los archivos ya subidos
+    calcular_diferencia_porcentual diferencias sobre las estadísticas de temporada
+    materializar_semanas           estadísticas por Week Team que consulta la Session Report
+    estadisticas_fecha             consulta de la Session Report para un día (caché vacía)
+    save_file                      subida del último archivo: merge del parquet y actualización incremental
+
+Cada etapa se ejecuta en un proceso nuevo para que el pico de memoria (VmHWM) sea solo suyo;
+se informa el pico del proceso y el incremento sobre lo que ocupaba antes de empezar la etapa.
+La lectura del Excel no se mide: el archivo se entrega ya como DataFrame.
+
+Uso:
+    python -m benchmarks.rendimiento [--escalas 1 10 100] [--json resultados.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.generador import generar_temporada, archivos_temporada
+
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ETAPAS = ['calcular_estadisticas', 'calcular_diferencia_porcentual', 'materializar_semanas',
+          'estadisticas_fecha', 'save_file']
+
+
+def _reiniciar_pico():
+    """
+    Reinicia el pico de memoria del proceso (Linux). Hace falta porque el proceso hijo
+    hereda el ru_maxrss del padre al arrancar.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def _memoria_mb():
+    """Pico de memoria residente del proceso actual en MB (VmHWM en Linux, ru_maxrss en el resto)"""
+    try:
+        with open('/proc/self/status') as f:
+            for linea in f:
+                if linea.startswith('VmHWM:'):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024
+
+def _ejecutar_etapa(etapa, carpeta, resultado):
+    """Ejecuta una etapa en un proceso hijo; los módulos leen los datos de la carpeta vía GPS_DATA_PATH"""
+    os.environ['GPS_DATA_PATH'] = carpeta
+    import polars as pl
+    from utils import utils
+    from utils.datos import fechas_disponibles
+    from utils.ingesta import incorporar_archivo
+
+    # Preparar las entradas de la etapa fuera de la medición
+    if etapa == 'calcular_estadisticas':
+        funcion = lambda: utils.calcular_estadisticas(materializar=False)
+    elif etapa == 'calcular_diferencia_porcentual':
+        entradas = []
+        for fichero in utils.FICHEROS_ESTADISTICAS.values():
+            df = pl.read_parquet(os.path.join(utils.DATA_PROCESSED_PATH, fichero))
+            entradas.append(df.select([col for col in df.columns if not col.endswith(' diff')]))
+        funcion = lambda: [utils.calcular_diferencia_porcentual(df) for df in entradas]
+    elif etapa == 'materializar_semanas':
+        funcion = lambda: utils.materializar_semanas()
+    elif etapa == 'estadisticas_fecha':
+        fechas = fechas_disponibles()
+        fecha = fechas[len(fechas) // 2]
+        funcion = lambda: utils.calcular_estadisticas(fecha=fecha, estadistica='median')
+    else:
+        df_ultimo = pl.read_parquet(os.path.join(carpeta, 'ultimo_archivo.parquet'))
+        funcion = lambda: incorporar_archivo(df_ultimo, df_ultimo['File Name'][0])
+
+    _reiniciar_pico()
+    memoria_inicial = _memoria_mb()
+    inicio = time.perf_counter()
+    funcion()
+    resultado['segundos'] = time.perf_counter() - inicio
+    resultado['pico_mb'] = _memoria_mb()
+    resultado['incremento_mb'] = resultado['pico_mb'] - memoria_inicial
+
+def _preparar_escala(escala, carpeta, resultado):
+    """Genera la temporada de la escala y deja subidos (como particiones) todos sus archivos salvo el último"""
+    os.environ['GPS_DATA_PATH'] = carpeta
+    from utils.datos import escribir_dataset
+
+    os.makedirs(os.path.join(carpeta, 'gps'), exist_ok=True)
+    shutil.copy(os.path.join(BASE_PATH, 'data', 'gps', 'Columnas_interés.txt'), os.path.join(carpeta, 'gps'))
+
+    import polars as pl
+    df = generar_temporada(equipos=escala)
+    archivos = archivos_temporada(df)
+    escribir_dataset(pl.concat([df_archivo for _, df_archivo in archivos[:-1]]))
+    archivos[-1][1].write_parquet(os.path.join(carpeta, 'ultimo_archivo.parquet'))
+    resultado['filas'] = df.height
+
+def _en_proceso(contexto, funcion, *args):
+    """Ejecuta funcion(*args, resultado) en un proceso nuevo y devuelve el diccionario resultado (None si falla)"""
+    with contexto.Manager() as manager:
+        resultado = manager.dict()
+        proceso = contexto.Process(target=funcion, args=(*args, resultado))
+        proceso.start()
+        proceso.join()
+        return dict(resultado) if proceso.exitcode == 0 else None
+
+def medir_escala(escala):
+    """Mide todas las etapas para una escala y devuelve una lista de resultados"""
+    contexto = multiprocessing.get_context('spawn')
+    resultados = []
+    with tempfile.TemporaryDirectory(prefix=f"gps_bench_{escala}x_") as carpeta:
+        preparacion = _en_proceso(contexto, _preparar_escala, escala, carpeta)
+        if preparacion is None:
+            print(f"La preparación de los datos ha fallado en la escala {escala}x")
+            return resultados
+        filas = preparacion['filas']
+        for etapa in ETAPAS:
+            resultado = _en_proceso(contexto, _ejecutar_etapa, etapa, carpeta)
+            if resultado is None:
+                print(f"La etapa {etapa} ha fallado en la escala {escala}x")
+                continue
+            resultados.append({'escala': escala, 'filas': filas, 'etapa': etapa, **resultado})
+            r = resultados[-1]
+            print(f"{escala:>5}x {filas:>10} {etapa:<32} {r['segundos']:>9.3f} s {r['pico_mb']:>9.1f} MB {r['incremento_mb']:>+9.1f} MB")
+    return resultados
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Latencia y pico de memoria del pipeline de estadísticas")
+    parser.add_argument('--escalas', type=int, nargs='+', default=[1, 10, 100],
+                        help="Múltiplos de una temporada real (número de equipos)")
+    parser.add_argument('--json', default=None, help="Guardar los resultados en un archivo JSON")
+    args = parser.parse_args()
+
+    print(f"{'escala':>6} {'filas':>10} {'etapa':<32} {'latencia':>11} {'pico':>12} {'incremento':>12}")
+    todos = []
+    for escala in args.escalas:
+        todos.extend(medir_escala(escala))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(todos, f, indent=2)
@@ -5,17 +5,22 @@
 # Importaciones de Dash
 from dash import html, dcc, Output, Input, State, callback_context
 import dash
+from flask import request, jsonify
 
 # Importaciones del sistema y utilidades
 import os
-import base64
-import re
-import polars as pl
 import datetime
 import json
 
 # Importación de funciones desde utils
-from utils.utils import calcular_estadisticas
+from utils.utils import actualizar_estadisticas
+from utils.ingesta import normalizar_nombre_archivo, descartar_archivos_identicos, leer_excels, incorporar_archivos
+from utils.datos import existe_dataset, catalogo_archivos, archivos_dataset, eliminar_particiones, escritura_exclusiva
+from utils.trabajos import (crear_trabajo, encolar_trabajo, actualizar_trabajo, avanzar_etapa,
+                            detallar_etapa, leer_trabajo, registrar_tarea, iniciar_cola, ruta_subida)
+
+# Tamaño de los bloques con que se escribe en disco el archivo subido
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
 
 # ============================================================================
@@ -39,8 +44,12 @@ def load_file_history():
     return []
 
 # Función para añadir una entrada al historial
+@escritura_exclusiva()
 def add_history_entry(action, filename):
-    """Añade una nueva entrada al historial con la acción, nombre de archivo y timestamp"""
+    """
+    Añade una nueva entrada al historial con la acción, nombre de archivo y timestamp.
+    Con el bloqueo de escritura tomado, para no perder entradas de otros workers.
+    """
     history = load_file_history()
     entry = {
         'action': action,
@@ -52,13 +61,43 @@ def add_history_entry(action, filename):
     # Define la carpeta y guarda el historial actualizado
     data_folder = os.path.join(os.path.dirname(__file__), '..', 'data')
     history_path = os.path.join(data_folder, 'file_history.json')
-    with open(history_path, 'w') as f:
+    # Se escribe en un temporal y se sustituye, así nunca se lee un historial a medias
+    with open(history_path + '.tmp', 'w') as f:
         json.dump(history, f)
+    os.replace(history_path + '.tmp', history_path)
         
 # ============================================================================
 # FUNCIONES DE INTERFAZ
 # ============================================================================
 
+# Función para generar la etiqueta de un archivo en el modal de edición
+def file_option_label(entry):
+    """Genera la etiqueta de un archivo del catálogo: nombre y, debajo, filas, fechas, jugadores y fecha de subida"""
+    details = [f"{entry['filas']} filas"]
+    if entry['desde'] and entry['hasta']:
+        details.append(f"{entry['desde']:%d/%m/%Y} - {entry['hasta']:%d/%m/%Y}")
+    if entry['jugadores'] is not None:
+        details.append(f"{entry['jugadores']} jugadores")
+    if entry['subido']:
+        details.append(f"subido el {entry['subido']:%d/%m/%Y %H:%M}")
+    return html.Span([
+        html.Span(entry['archivo'], className="file-name"),
+        html.Span(" · ".join(details), className="file-date")
+    ], className="file-option")
+
+# Función para generar el progreso de un trabajo en segundo plano
+def job_stages_component(job):
+    """Genera la lista de etapas de un trabajo con el tiempo de cada una (la etapa en curso sin tiempo) y sus detalles"""
+    stages = []
+    for stage in job['etapas']:
+        if stage['segundos'] is None:
+            stages.append(html.Li(f"⏳ {stage['etapa']}..."))
+        else:
+            stages.append(html.Li(f"✓ {stage['etapa']} ({stage['segundos']:.1f} s)"))
+        if stage.get('detalles'):
+            stages.append(html.Li(html.Ul([html.Li(detail) for detail in stage['detalles']])))
+    return html.Ul(stages, className="job-stages")
+
 # Función para generar el componente de historial de archivos
 def generate_history_component(history=None):
     """Genera el componente HTML que muestra el historial de archivos"""
@@ -101,17 +140,16 @@ layout = html.Div([
         html.Div([
             html.Div("GPS", className="gps-label"),
             html.Div([
-                # Componente para subir archivos XLSX
-                dcc.Upload(
-                    id='upload-data',
-                    children=html.Button('Upload', className='btn-upload', style={
-                                'cursor': 'pointer',
-                                'display': 'inline-block'
-                    }),
-                    multiple=False,
-                    accept='.xlsx',
-                    style={'display': 'inline-block'}
-                ),
+                # Subida de archivos XLSX: assets/upload.js envía el archivo a /api/upload
+                # y deja en 'upload-job-id' el id del trabajo (o el error) que siguen los callbacks
+                html.Button('Upload', id='upload-btn', className='btn-upload', style={
+                            'cursor': 'pointer',
+                            'display': 'inline-block'
+                }),
+                dcc.Input(id='upload-job-id', type='text', value='', style={'display': 'none'}),
+                # Trabajo en segundo plano (subida o eliminación) cuyo progreso se muestra
+                dcc.Store(id='job-store'),
+                dcc.Interval(id='job-progress-interval', interval=1000, disabled=True),
                 # Botón para editar archivos
                 html.Button(
                     'EDIT', 
@@ -161,124 +199,216 @@ layout = html.Div([
 # CALLBACKS
 # ============================================================================
 
+# ============================================================================
+# SUBIDA DE ARCHIVOS
+# ============================================================================
+
+def process_upload(job_id, filenames):
+    """
+    Trabajo 'subida': descarta los archivos idénticos a otros ya subidos, lee en paralelo el resto,
+    añade sus filas nuevas al dataset en una sola versión, actualiza las estadísticas una vez
+    y registra el historial.
+    """
+    paths = [ruta_subida(job_id, i) for i in range(len(filenames))]
+    try:
+        # Cambiar el nombre de los archivos ("dd_mm_aaaa_al_dd_mm_aaaa.xlsx")
+        filenames = [normalizar_nombre_archivo(filename) for filename in filenames]
+        actualizar_trabajo(job_id, archivo=', '.join(filenames))
+
+        # Los archivos idénticos (misma huella) a otros ya subidos no se llegan a leer
+        avanzar_etapa(job_id, "Comprobación de archivos")
+        pending, errors = descartar_archivos_identicos(list(zip(paths, filenames)))
+        fingerprints = {filename: fingerprint for _, filename, fingerprint in pending}
+
+        # Se leen desde los archivos temporales, repartidos entre varios procesos
+        parsed = []
+        results = []
+        if pending:
+            avanzar_etapa(job_id, "Lectura de los Excel")
+            results = leer_excels([(path, filename) for path, filename, _ in pending])
+        for (_, filename, _), (df_new, error, throughput) in zip(pending, results):
+            if error is not None:
+                errors[filename] = error
+            else:
+                parsed.append((df_new, filename))
+                detallar_etapa(job_id, f"{filename}: {throughput}")
+
+        # Añade las filas nuevas al dataset y actualiza las estadísticas (una sola vez para todo el lote)
+        added, rejected, warnings = ([], {}, [])
+        if parsed:
+            added, rejected, warnings = incorporar_archivos(parsed, progreso=lambda stage: avanzar_etapa(job_id, stage),
+                                                            huellas=fingerprints)
+        errors.update(rejected)
+
+        # Registra la acción en el historial
+        avanzar_etapa(job_id, "Historial")
+        for filename in added:
+            add_history_entry("upload", filename)
+
+        if not added:
+            actualizar_trabajo(job_id, estado='error', mensaje=' '.join(errors.values()), avisos=warnings)
+        else:
+            names = ', '.join(f"'{filename}'" for filename in added)
+            actualizar_trabajo(job_id, estado='terminado', errores=list(errors.values()), avisos=warnings,
+                               mensaje=f"Archivo{'s' if len(added) > 1 else ''} {names} procesado{'s' if len(added) > 1 else ''} y datos añadidos al dataframe.")
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+def process_removal(job_id, filenames):
+    """
+    Trabajo 'eliminacion': quita del dataset las particiones de los archivos indicados,
+    registra el historial y actualiza solo las estadísticas de los grupos afectados.
+    """
+    removed = []
+    not_found = list(filenames)
+    df_eliminado = None
+    
+    # Quitar las particiones de los archivos seleccionados (solo cambia el manifest)
+    avanzar_etapa(job_id, "Eliminación de archivos")
+    if existe_dataset():
+        try:
+            # Eliminación e historial en un mismo bloque de escritura
+            with escritura_exclusiva():
+                # Solo se eliminan (y se registran) los archivos que están en el dataset
+                existentes = set(archivos_dataset())
+                removed = [f for f in filenames if f in existentes]
+                not_found = [f for f in filenames if f not in existentes]
+
+                # Filas eliminadas, para actualizar solo los grupos afectados
+                if removed:
+                    df_eliminado = eliminar_particiones(removed)
+                    for f in removed:
+                        # Registra la eliminación en el historial
+                        add_history_entry("remove", f)
+                    
+        except Exception as e:
+            # Si falla antes de publicar el manifest, el dataset anterior sigue intacto
+            print(f"Error al procesar el dataframe: {str(e)}")
+            actualizar_trabajo(job_id, estado='error', mensaje=f"Error al actualizar el dataframe: {str(e)}")
+            return
+    
+    # Preparar mensaje de confirmación
+    if removed:
+        # Verificar si quedan datos después de la eliminación
+        if not existe_dataset():
+            msg = f"Todos los archivos fueron eliminados ({', '.join(removed)}). El dataframe ha sido completamente eliminado."
+        else:
+            msg = f"Archivos eliminados: {', '.join(removed)}."
+    else:
+        msg = "No se eliminó ningún archivo."
+    if not_found:
+        msg += f" No se encontraron en el dataset: {', '.join(not_found)}."
+    
+    # Actualiza solo las estadísticas de los grupos que contenían los archivos eliminados
+    avanzar_etapa(job_id, "Estadísticas")
+    try:
+        # Si el dataframe ha quedado vacío, actualizar_estadisticas elimina las estadísticas guardadas
+        if df_eliminado is not None and df_eliminado.height > 0:
+            resultado = actualizar_estadisticas(df_eliminado, eliminado=True)
+            if not existe_dataset():
+                print("El dataframe ha quedado vacío: estadísticas eliminadas.")
+            elif resultado is not None and len(resultado) > 0 and resultado[0] is not None:
+                print("Estadísticas calculadas correctamente después de editar archivos.")
+            else:
+                print("No hay suficientes datos para calcular estadísticas.")
+        else:
+            print("No hay datos en el dataframe para calcular estadísticas.")
+    except Exception as e:
+        print(f"Error al calcular estadísticas: {str(e)}")
+    
+    actualizar_trabajo(job_id, estado='terminado', mensaje=msg)
+
+# Funciones que ejecuta la cola de trabajos (utils/trabajos.py) para cada tipo de trabajo
+registrar_tarea('subida', process_upload)
+registrar_tarea('eliminacion', process_removal)
+
+def register_routes(app):
+    """Registra las rutas Flask de la página en el servidor de la app"""
+
+    # La cola arranca con la primera petición que atiende este proceso (ver utils/trabajos.py)
+    app.server.before_request(iniciar_cola)
+
+    @app.server.route('/api/upload', methods=['POST'])
+    def upload_file():
+        """
+        Recibe uno o varios XLSX por multipart/form-data (campo 'file'), los guarda en disco por
+        bloques y los procesa en segundo plano como un único lote. Devuelve {'job_id': ...} o {'error': ...}.
+        """
+        uploads = [uploaded for uploaded in request.files.getlist('file') if uploaded.filename]
+        if not uploads:
+            return jsonify({'error': "No se ha seleccionado ningún archivo."}), 400
+        invalid = [uploaded.filename for uploaded in uploads if not uploaded.filename.endswith('.xlsx')]
+        if invalid:
+            return jsonify({'error': f"El archivo no tiene la extensión .xlsx: {', '.join(invalid)}."}), 400
+
+        # Werkzeug ya vuelca a disco las partes grandes; aquí se copian a las rutas del trabajo por bloques
+        filenames = [uploaded.filename for uploaded in uploads]
+        job_id = crear_trabajo('subida', ', '.join(filenames), {'filenames': filenames})
+        for i, uploaded in enumerate(uploads):
+            uploaded.save(ruta_subida(job_id, i), buffer_size=UPLOAD_CHUNK_SIZE)
+        encolar_trabajo(job_id)
+        return jsonify({'job_id': job_id})
+
 def register_callbacks(app):
     """Registra todos los callbacks de la página"""
     
     # ========================================================================
-    # Callback para subir archivos y actualizar el Parquet consolidado
+    # Callbacks para seguir el progreso de los trabajos (subidas por /api/upload y eliminaciones)
     # ========================================================================
     @app.callback(
-        [Output('status-messages', 'children'),
-         Output('file-history', 'children', allow_duplicate=True)],
-        Input('upload-data', 'contents'),
-        State('upload-data', 'filename'),
+        [Output('job-store', 'data', allow_duplicate=True),
+         Output('job-progress-interval', 'disabled', allow_duplicate=True),
+         Output('status-messages', 'children', allow_duplicate=True)],
+        Input('upload-job-id', 'value'),
         prevent_initial_call=True
     )
-    def save_file(contents, filename):
-        """Procesa la subida de archivos, actualiza el Parquet consolidado y el historial sin guardar archivos Excel"""
-        
-        # Si no hay archivo subido, no hacer nada
-        if contents is None or filename is None:
-            return [html.Div("No se ha seleccionado ningún archivo.", className="error-msg")], dash.no_update
-
-        # Si el nombre del archivo no tiene la extensión .xlsx, añadirla
-        if not filename.endswith('.xlsx'):
-            return [html.Div("El archivo no tiene la extensión .xlsx.", className="error-msg")], dash.no_update
-
-        # Cambiar el nombre del archivo ("dd_mm_aaaa_al_dd_mm_aaaa.xlsx")
-        match = re.search(r'(\d{2})-(\d{2})-(\d{4}).*?(\d{2})-(\d{2})-(\d{4})', filename)
-        filename_original = filename
-        if match:
-            day1, month1, year1, day2, month2, year2 = match.groups()
-            filename = f"{day1}_{month1}_{year1}_al_{day2}_{month2}_{year2}.xlsx"
-   
-        # Define la carpeta donde se guardará el archivo Parquet consolidado
-        gps_folder = os.path.join(os.path.dirname(__file__), '..', 'data', 'gps')
-        os.makedirs(gps_folder, exist_ok=True)
-        merge_path = os.path.join(gps_folder, 'df_gps.parquet')
-        backup_path = os.path.join(gps_folder, 'df_gps_backup.parquet')
+    def start_upload_tracking(upload_response):
+        """Recibe la respuesta de /api/upload (JSON con job_id o error) y activa el seguimiento del trabajo"""
+        if not upload_response:
+            return dash.no_update, dash.no_update, dash.no_update
         
         try:
-            # Decodifica el archivo subido y lo lee directamente en memoria sin guardarlo
-            _, content_string = contents.split(',')
-            decoded = base64.b64decode(content_string)
-            
-            # Lee el archivo XLSX desde memoria y añade la columna 'File Name'
-            import io
-            df_new = pl.read_excel(io.BytesIO(decoded))
-            df_new = df_new.with_columns(pl.lit(filename).alias('File Name'))
-            
-            # Crear una copia de seguridad del Parquet actual si existe
-            if os.path.exists(merge_path) and os.path.getsize(merge_path) > 0:
-                try:
-                    # Leer el archivo Parquet actual para verificar que sea válido
-                    df_actual = pl.read_parquet(merge_path)
-                    if df_actual.height > 0:
-                        # Verificar si el archivo ya existe en el dataframe
-                        if filename in df_actual['File Name'].unique():
-                            return [html.Div(f"El archivo '{filename}' ya existe en el dataframe.", className="error-msg")], dash.no_update
-                        
-                        # Crear copia de seguridad
-                        import shutil
-                        shutil.copy2(merge_path, backup_path)
-                        print(f"Se ha creado una copia de seguridad del archivo")
-                        
-                        # Concatenar el nuevo dataframe con el existente
-                        try:                        
-                            # Intentar convertir todas las columnas numéricas a float
-                            numeric_cols = [col for col in df_actual.columns if df_actual[col].dtype in [pl.Int64, pl.Float64]]
-                            
-                            # Convertir columnas numéricas a float en ambos dataframes
-                            for col in numeric_cols:
-                                if col in df_actual.columns and col in df_new.columns:
-                                    df_actual = df_actual.with_columns(pl.col(col).cast(pl.Float64))
-                                    df_new = df_new.with_columns(pl.col(col).cast(pl.Float64))
-                            
-                            # Intentar concatenar nuevamente
-                            df_merge = pl.concat([df_actual, df_new], how='diagonal')
-                        except Exception as concat_error:
-                            print(f"Error en la concatenación: {str(concat_error)}")
-                            # En caso de error en la concatenación, usar solo el nuevo dataframe
-                            df_merge = df_new
-                        
-                except Exception as e:
-                    print(f"Error al leer el Parquet actual o crear copia de seguridad: {str(e)}")
-                    return [html.Div(f"Error al procesar el archivo: {str(e)}", className="error-msg")], dash.no_update
-            else:
-                # Si no existe el Parquet, el nuevo dataframe será el consolidado
-                df_merge = df_new
-            
-            # Guardar el dataframe consolidado en formato Parquet
-            df_merge.write_parquet(merge_path)
-            
-            # Registra la acción en el historial
-            add_history_entry("upload", filename)
-            
-            # Ejecuta la función calcular_estadisticas para actualizar las estadísticas
-            try:
-                resultado = calcular_estadisticas()
-                if resultado is not None and len(resultado) > 0 and resultado[0] is not None:
-                    print("Estadísticas calculadas correctamente después de añadir archivo.")
-                else:
-                    print("No hay suficientes datos para calcular estadísticas.")
-            except Exception as e:
-                print(f"Error al calcular estadísticas: {str(e)}")
-            
-            # Actualiza el componente de historial
-            updated_history = generate_history_component()
-            
-        except Exception as e:
-            # Restaurar desde la copia de seguridad si existe
-            if os.path.exists(backup_path) and os.path.getsize(backup_path) > 0:
-                try:
-                    import shutil
-                    shutil.copy2(backup_path, merge_path)
-                    print(f"Se ha restaurado el archivo {merge_path} desde la copia de seguridad después de un error.")
-                except Exception as backup_error:
-                    print(f"Error al restaurar desde la copia de seguridad: {str(backup_error)}")
-            return [html.Div(f"Error al procesar el archivo: {str(e)}", className="error-msg")], dash.no_update
+            response = json.loads(upload_response)
+        except ValueError:
+            response = {'error': upload_response}
+        
+        if 'job_id' not in response:
+            return None, True, [html.Div(response.get('error') or "Error al subir el archivo.", className="error-msg")]
+        
+        return response['job_id'], False, [html.Div("Archivo subido. Procesando...", className="info-msg")]
+
+    @app.callback(
+        [Output('status-messages', 'children', allow_duplicate=True),
+         Output('file-history', 'children', allow_duplicate=True),
+         Output('job-progress-interval', 'disabled', allow_duplicate=True)],
+        Input('job-progress-interval', 'n_intervals'),
+        State('job-store', 'data'),
+        prevent_initial_call=True
+    )
+    def track_job(n_intervals, job_id):
+        """Muestra el estado y las etapas del trabajo en curso y actualiza el historial cuando termina"""
+        job = leer_trabajo(job_id)
+        if job is None:
+            return [html.Div("No se encontró el trabajo.", className="error-msg")], dash.no_update, True
+        
+        # Solapes con archivos ya subidos (filas repetidas que no se añadieron)
+        warnings = [html.Div(warning, className="info-msg") for warning in job['avisos']]
+        
+        if job['estado'] == 'error':
+            return [html.Div(job['mensaje'], className="error-msg")] + warnings + [job_stages_component(job)], generate_history_component(), True
         
-        return [html.Div(f"Archivo '{filename}' procesado y datos añadidos al dataframe.", className="success-msg")], updated_history
+        if job['estado'] == 'terminado':
+            # Archivos procesados y, si los hubo, los descartados del lote
+            messages = [html.Div(job['mensaje'], className="success-msg")]
+            messages += [html.Div(error, className="error-msg") for error in job['errores']]
+            return messages + warnings + [job_stages_component(job)], generate_history_component(), True
+        
+        if job['estado'] == 'en cola':
+            return [html.Div(f"'{job['archivo']}' en cola, esperando a otro trabajo...", className="info-msg")], dash.no_update, False
+        
+        return [html.Div(f"Procesando '{job['archivo']}'...", className="info-msg"), job_stages_component(job)], dash.no_update, False
     
     
 
@@ -307,12 +437,8 @@ def register_callbacks(app):
         
         # Si se presionó el botón de editar, mostrar el modal con contenido
         if button_id == 'edit-files-btn':
-            # Obtiene la lista de archivos desde el dataframe consolidado
-            gps_folder = os.path.join(os.path.dirname(__file__), '..', 'data', 'gps')
-            merge_path = os.path.join(gps_folder, 'df_gps.parquet')
-            
-            # Verificar si el archivo parquet existe
-            if not os.path.exists(merge_path):
+            # Verificar si hay datos cargados
+            if not existe_dataset():
                 modal_content = html.Div([
                     html.P('No hay archivos cargados aún.', style={'margin-bottom': '10px'}),
                     html.P('Por favor, cargue primero algunos archivos usando el botón "Upload".')
@@ -320,14 +446,8 @@ def register_callbacks(app):
                 return {"display": "flex"}, modal_content
             
             try:
-                # Leer el dataframe consolidado
-                df = pl.read_parquet(merge_path)
-                if df.height == 0:
-                    modal_content = html.Div('No hay datos para editar.', className="error-msg")
-                    return {"display": "flex"}, modal_content
-                
-                # Obtener la lista única de nombres de archivos
-                files = df['File Name'].unique().to_list()
+                # Archivos subidos y sus datos, leídos del catálogo (sin abrir el dataset)
+                files = catalogo_archivos()
                 
                 if not files:
                     modal_content = html.Div([
@@ -341,7 +461,7 @@ def register_callbacks(app):
                     html.Label('Seleccione los archivos que desea eliminar:', className="modal-label"),
                     dcc.Checklist(
                         id='files-checklist',
-                        options=[{'label': f, 'value': f} for f in files],
+                        options=[{'label': file_option_label(f), 'value': f['archivo']} for f in files],
                         value=[],  # Lista vacía para que ningún archivo esté seleccionado por defecto
                         inputStyle={'marginRight': '8px'},
                         className="modal-checklist"
@@ -363,7 +483,8 @@ def register_callbacks(app):
     @app.callback(
         [
             Output('status-messages', 'children', allow_duplicate=True),
-            Output('file-history', 'children', allow_duplicate=True),
+            Output('job-store', 'data', allow_duplicate=True),
+            Output('job-progress-interval', 'disabled', allow_duplicate=True),
             Output('edit-modal', 'style', allow_duplicate=True)
         ],
         Input('confirm-edit-btn', 'n_clicks'),
@@ -371,102 +492,16 @@ def register_callbacks(app):
         prevent_initial_call=True
     )
     def confirm_edit(confirm_clicks, selected_files):
-        """Procesa la confirmación de la edición de archivos en el dataframe consolidado"""
+        """Encola la eliminación de los archivos seleccionados y activa el seguimiento del trabajo"""
         if not confirm_clicks:
-            return dash.no_update, dash.no_update, dash.no_update
-            
-        # Define la ruta del archivo Parquet consolidado
-        gps_folder = os.path.join(os.path.dirname(__file__), '..', 'data', 'gps')
-        merge_path = os.path.join(gps_folder, 'df_gps.parquet')
-        backup_path = os.path.join(gps_folder, 'df_gps_backup.parquet')
-        removed = []
-        
-        # Crear una copia de seguridad del archivo Parquet actual si existe y no está vacío
-        if os.path.exists(merge_path) and os.path.getsize(merge_path) > 0:
-            try:
-                # Leer el archivo Parquet actual para verificar que sea válido
-                df_actual = pl.read_parquet(merge_path)
-                if df_actual.height > 0:
-                    # Crear copia de seguridad
-                    import shutil
-                    shutil.copy2(merge_path, backup_path)
-                    print(f"Se ha creado una copia de seguridad del archivo")
-                    
-                    # Filtrar el dataframe para eliminar los archivos seleccionados
-                    if selected_files:
-                        # Filtrar el dataframe para mantener solo los archivos que no están seleccionados
-                        df_filtrado = df_actual.filter(~pl.col('File Name').is_in(selected_files))
-                        
-                        # Identificar archivos eliminados para el mensaje
-                        for f in selected_files:
-                            removed.append(f)
-                            # Registra la eliminación en el historial
-                            add_history_entry("remove", f)
-                        
-                        # Verificar si el dataframe filtrado está vacío (todos los archivos fueron eliminados)
-                        if df_filtrado.height == 0:
-                            # Si no hay más datos, eliminar el archivo Parquet
-                            if os.path.exists(merge_path):
-                                os.remove(merge_path)
-                                print("Todos los archivos fueron eliminados. Archivo df_gps.parquet eliminado.")
-                            # También eliminar el backup si existe
-                            if os.path.exists(backup_path):
-                                os.remove(backup_path)
-                                print("Archivo de backup eliminado.")
-                        else:
-                            # Guardar el dataframe filtrado en formato Parquet
-                            df_filtrado.write_parquet(merge_path)
-                            print("Dataframe filtrado guardado correctamente.")
-                        
-                        # Asignar df_filtrado a df_merge para evitar el error
-                        df_merge = df_filtrado
-                        
-            except Exception as e:
-                print(f"Error al procesar el dataframe: {str(e)}")
-                # Restaurar desde la copia de seguridad si existe
-                if os.path.exists(backup_path) and os.path.getsize(backup_path) > 0:
-                    try:
-                        import shutil
-                        shutil.copy2(backup_path, merge_path)
-                        print(f"Se ha restaurado el archivo {merge_path} desde la copia de seguridad después de un error.")
-                    except Exception as backup_error:
-                        print(f"Error al restaurar desde la copia de seguridad: {str(backup_error)}")
-                return [html.Div(f"Error al actualizar el dataframe: {str(e)}", className="error-msg")], dash.no_update
-        
-        # Preparar mensaje de confirmación
-        if removed:
-            # Verificar si el archivo Parquet aún existe después de la eliminación
-            if not os.path.exists(merge_path):
-                msg = f"Todos los archivos fueron eliminados ({', '.join(removed)}). El dataframe ha sido completamente eliminado."
-            else:
-                msg = f"Archivos eliminados: {', '.join(removed)}."
-        else:
-            msg = "No se eliminó ningún archivo."
+            return dash.no_update, dash.no_update, dash.no_update, dash.no_update
         
         if not selected_files:
-            msg = "No se seleccionó ningún archivo para eliminar."
-        
-        #Ejecuta la función calcular_estadisticas para actualizar las estadísticas
-        try:
-            # Verificar si aún hay datos en el dataframe después de eliminar archivos
-            if os.path.exists(merge_path) and os.path.getsize(merge_path) > 0:
-                df_check = pl.read_parquet(merge_path)
-                if df_check.height > 0:
-                    resultado = calcular_estadisticas()
-                    if resultado is not None and len(resultado) > 0 and resultado[0] is not None:
-                        print("Estadísticas calculadas correctamente después de editar archivos.")
-                    else:
-                        print("No hay suficientes datos para calcular estadísticas.")
-                else:
-                    print("No hay datos en el dataframe para calcular estadísticas.")
-            else:
-                print("No existe el archivo de datos para calcular estadísticas.")
-        except Exception as e:
-            print(f"Error al calcular estadísticas: {str(e)}")
+            return [html.Div("No se seleccionó ningún archivo para eliminar.", className="success-msg")], dash.no_update, dash.no_update, {"display": "none"}
         
-        # Actualiza el componente de historial
-        updated_history = generate_history_component()
+        # La eliminación y el recálculo de estadísticas se hacen en segundo plano (process_removal)
+        job_id = crear_trabajo('eliminacion', ', '.join(selected_files), {'filenames': selected_files})
+        encolar_trabajo(job_id)
         
-        # Oculta el modal y muestra el mensaje de confirmación
-        return [html.Div(msg, className="success-msg")], updated_history, {"display": "none"}
-    
\ No newline at end of file
+        # Oculta el modal y muestra el progreso del trabajo
+        return [html.Div("Eliminando archivos...", className="info-msg")], job_id, False, {"display": "none"}
@@ -11,7 +11,8 @@ import os
 import datetime
 import polars as pl
 import pandas as pd
-from utils.utils import DATA_GPS_PATH, calcular_estadisticas
+from utils.utils import DATA_GPS_PATH, calcular_estadisticas, opciones_estadisticas, etiqueta_estadistica
+from utils.datos import existe_dataset, fechas_disponibles, leer_sesion, a_fecha, resumen_sesion
 
 # Importaciones del Plotly para gráficos
 import plotly.graph_objects as go
@@ -108,49 +109,15 @@ COMBINED_TABLE_STYLES = {
 # ============================================================================
 
 def get_sorted_dates():
-        """Función auxiliar para obtener fechas ordenadas cronológicamente del archivo parquet"""
+        """Función auxiliar para obtener fechas ordenadas cronológicamente del dataset"""
         try:
-            path_to_parquet = os.path.join(DATA_GPS_PATH, 'df_gps.parquet')
-            if not os.path.exists(path_to_parquet):
+            # Fechas únicas del dataset, leídas del índice de sesiones (no se leen los datos GPS)
+            fechas_raw = fechas_disponibles()
+            if not fechas_raw:
                 return []
-                
-            df = pl.read_parquet(path_to_parquet)
-            if df.height == 0 or 'Date' not in df.columns:
-                return []
-                
-            # Obtener fechas únicas del DataFrame
-            fechas_raw = df.select('Date').unique()['Date'].to_list()
-            
-            # Convertir todas las fechas al formato dd/mm/aaaa y ordenar cronológicamente
-            fechas_datetime = []
-            for fecha in fechas_raw:
-                try:
-                    if isinstance(fecha, str):
-                        # Convertir diferentes formatos a dd/mm/aaaa
-                        if '/' in fecha:
-                            # Ya está en formato dd/mm/aaaa
-                            fecha_dt = datetime.datetime.strptime(fecha, '%d/%m/%Y')
-                            fecha_formatted = fecha
-                        elif '-' in fecha:
-                            # Convertir de aaaa-mm-dd a dd/mm/aaaa
-                            fecha_dt = datetime.datetime.strptime(fecha, '%Y-%m-%d')
-                            fecha_formatted = fecha_dt.strftime('%d/%m/%Y')
-                        else:
-                            continue
-                        fechas_datetime.append((fecha_dt, fecha_formatted))
-                    else:
-                        # Si es datetime object, convertir a string dd/mm/aaaa
-                        fecha_formatted = fecha.strftime('%d/%m/%Y')
-                        fechas_datetime.append((fecha, fecha_formatted))
-                except Exception as e:
-                    print(f"Error procesando fecha {fecha}: {e}")
-                    continue
             
-            # Ordenar cronológicamente y extraer solo las fechas en formato dd/mm/aaaa
-            fechas_datetime.sort(key=lambda x: x[0])
-            fechas_ordenadas = [fecha_str for fecha_dt, fecha_str in fechas_datetime]
-            
-            return fechas_ordenadas
+            # Las fechas ya vienen tipadas y ordenadas; solo se formatean como dd/mm/aaaa
+            return [fecha.strftime('%d/%m/%Y') for fecha in fechas_raw]
             
         except Exception as e:
             print(f"Error obteniendo fechas del parquet: {e}")
@@ -189,48 +156,33 @@ def get_columns_of_interest():
         print(f"Error al cargar columnas de interés: {e}")
         return []
 
-def format_and_filter_date(selected_date):
+def format_and_filter_date(selected_date, columnas=None):
     """
     Formatea la fecha seleccionada y filtra el dataframe para esa fecha.
+    Si se indican columnas, solo se leen esas columnas del dataset.
     """
     
-    path_to_parquet = os.path.join(DATA_GPS_PATH, 'df_gps.parquet')
-    if not os.path.exists(path_to_parquet):
-        print(f"Archivo parquet no existe: {path_to_parquet}")
+    if not existe_dataset():
+        print(f"Archivo parquet no existe: {os.path.join(DATA_GPS_PATH, 'df_gps.parquet')}")
         return None
-        
-    df = pl.read_parquet(path_to_parquet)
-    df_filtered = (df.filter(pl.col('Match Day') != 'Rehab')
-                      .filter(pl.col('Player') != 'TEAM')
-                      .filter(pl.col('Team ') != 'TEAM')
-                      .filter(pl.col('Selection') == 'Drills')
-                      .with_columns(
-                          pl.when(pl.col('Team ').str.contains('Sporting'))
-                          .then(pl.lit('Sporting de Gijón'))
-                          .otherwise(pl.col('Team '))
-                          .alias('Team ')
-                      ))
     
-    # Convertir la fecha seleccionada al formato correcto
-    if isinstance(selected_date, str):
-        try:
-            selected_dt = datetime.datetime.strptime(selected_date, '%Y-%m-%d')
-            formatted_date = selected_dt.strftime('%d/%m/%Y')
-        except:
-            formatted_date = selected_date
-    else:
-        formatted_date = selected_date
+    # Convertir la fecha seleccionada (aaaa-mm-dd del DatePickerSingle) a date
+    fecha = a_fecha(selected_date)
+    if fecha is None:
+        print(f"Fecha no válida: {selected_date}")
+        return None
+    formatted_date = fecha.strftime('%d/%m/%Y')
         
     #print(f"Buscando datos para fecha: {formatted_date}")
     
-    # Filtrar datos para la fecha formateada
-    df_fecha = df_filtered.filter(pl.col('Date') == formatted_date)
+    # Filtrar datos por la columna Date tipada (el filtro se aplica durante la lectura)
+    df_fecha = leer_sesion(fecha, columnas)
     #print(f"Encontradas {df_fecha.height} filas para la fecha {formatted_date}")
     
     if df_fecha is None or df_fecha.height == 0:
         print("No se encontraron datos para ningún formato de fecha")
         # Mostrar algunas fechas disponibles para debug
-        available_dates = df.select('Date').unique().limit(5)['Date'].to_list()
+        available_dates = fechas_disponibles()[:5]
         print(f"Fechas disponibles (muestra): {available_dates}")
         return None
         
@@ -240,46 +192,22 @@ def format_and_filter_date(selected_date):
 def filter_and_get_players_data(selected_date):
     """Filtra los datos GPS por fecha y aplica los filtros especificados"""
     try:
-        path_to_parquet = os.path.join(DATA_GPS_PATH, 'df_gps.parquet')
-        if not os.path.exists(path_to_parquet):
-            print(f"Archivo parquet no existe: {path_to_parquet}")
-            return None
-        
-        df = pl.read_parquet(path_to_parquet)
-        #print(f"DataFrame cargado con {df.height} filas y {len(df.columns)} columnas")
-        
-        df_fecha, formatted_date = format_and_filter_date(selected_date)
-        
-        #print(f"Datos encontrados para la fecha: {df_fecha.height} filas")
-        # Aplicar filtros como en utils.py
-        df_filtered = (df_fecha.filter(pl.col('Match Day') != 'Rehab')
-                      .filter(pl.col('Player') != 'TEAM')
-                      .filter(pl.col('Team ') != 'TEAM')
-                      .filter(pl.col('Selection') == 'Drills')
-                      .with_columns(
-                          pl.when(pl.col('Team ').str.contains('Sporting'))
-                          .then(pl.lit('Sporting de Gijón'))
-                          .otherwise(pl.col('Team '))
-                          .alias('Team ')
-                      ))
-        #print(f"Después de filtros: {df_filtered.height} filas")
-        
         # Obtener columnas de interés
         columns_of_interest = get_columns_of_interest()
         #print(f"Columnas de interés: {columns_of_interest}")
         
-        # Seleccionar columnas básicas + columnas de interés que existan en el DataFrame
+        # Leer solo Player + columnas de interés de la fecha, con los filtros de utils.py aplicados en la lectura
         basic_columns = ['Player']
-        available_columns = [col for col in columns_of_interest if col in df_filtered.columns]
-        #print(f"Columnas disponibles en DataFrame: {available_columns}")
+        resultado = format_and_filter_date(selected_date, basic_columns + columns_of_interest)
+        if resultado is None:
+            print("DataFrame filtrado está vacío")
+            return None
         
-        selected_columns = basic_columns + available_columns
-        #print(f"Columnas seleccionadas: {selected_columns}")
+        df_filtered, formatted_date = resultado
+        #print(f"Después de filtros: {df_filtered.height} filas")
         
         if df_filtered.height > 0:
-            result_df = df_filtered.select(selected_columns)
-            #print(f"DataFrame resultado: {result_df.height} filas, {len(result_df.columns)} columnas")
-            return result_df
+            return df_filtered
         else:
             print("DataFrame filtrado está vacío")
             return None
@@ -337,15 +265,7 @@ layout = html.Div([
                     html.Label('Estadística:', className="input-label"),
                     dcc.Dropdown(
                         id='statistic-selector',
-                        options=[
-                            {'label': 'Media', 'value': 'mean'},
-                            {'label': 'Mediana', 'value': 'median'},
-                            {'label': 'Máximo', 'value': 'max'},
-                            {'label': 'Mínimo', 'value': 'min'},
-                            {'label': 'Percentil 75', 'value': 'p75'},
-                            {'label': 'Percentil 90', 'value': 'p90'},
-                            {'label': 'Percentil 95', 'value': 'p95'}
-                        ],
+                        options=opciones_estadisticas(),
                         value='median',
                         placeholder='Selecciona una estadística...',
                         className="statistic-dropdown"
@@ -562,30 +482,24 @@ def register_callbacks(app):
                           className="info-message")
         
         try:
-            path_to_parquet = os.path.join(DATA_GPS_PATH, 'df_gps.parquet')
-            if not os.path.exists(path_to_parquet):
+            if not existe_dataset():
                 return html.Div("No se encontró el archivo de datos.", 
                               className="error-message")
             
-            df = pl.read_parquet(path_to_parquet)
-            
-            df_fecha, formatted_date = format_and_filter_date(selected_date)
-
+            # Jugadores, duración y Match Days de la sesión salen del índice de sesiones (sin leer los datos)
+            sesion = resumen_sesion(selected_date)
             
-            if df_fecha is None or df_fecha.height == 0:
+            if sesion is None or not sesion['jugadores']:
                 return html.Div(f"No se encontraron datos para la fecha {selected_date}.", 
                               className="warning-message")
-            
+            formatted_date = a_fecha(selected_date).strftime('%d/%m/%Y')
             
             # Obtener información básica de la sesión
-            num_jugadores = df_fecha.select('Player').n_unique()
-            
-            # Calcular duración total de drills si la columna existe
-            if 'Drills Duration' in df_fecha.columns:
-                duration = df_fecha.select('Drills Duration').row(0)[0]
+            num_jugadores = len(sesion['jugadores'])
+            duration = sesion['duracion']
             
-            # Filtrar Match Days excluyendo 'Rehab'
-            match_days_filtered = df_fecha.filter(pl.col('Match Day') != 'Rehab').select('Match Day').unique().to_series().to_list()
+            # Match Days de la sesión (el índice ya excluye 'Rehab')
+            match_days_filtered = sesion['match_days']
             
             # Crear información base
             session_info = [
@@ -597,16 +511,7 @@ def register_callbacks(app):
             
             # Agregar información de estadística si está seleccionada
             if selected_statistic:
-                statistic_labels = {
-                    'mean': 'Media',
-                    'median': 'Mediana', 
-                    'max': 'Máximo',
-                    'min': 'Mínimo',
-                    'p75': 'Percentil 75',
-                    'p90': 'Percentil 90',
-                    'p95': 'Percentil 95'
-                }
-                statistic_name = statistic_labels.get(selected_statistic, selected_statistic)
+                statistic_name = etiqueta_estadistica(selected_statistic)
                 session_info.append(
                     html.P(f"Estadística seleccionada: {statistic_name}", 
                           className="session-detail statistic-selected")
@@ -641,7 +546,7 @@ def register_callbacks(app):
         
         try:
             # Convertir fecha al formato correcto para calcular_estadisticas
-            df_fecha, formatted_date = format_and_filter_date(selected_date)
+            df_fecha, formatted_date = format_and_filter_date(selected_date, ['Match Day'])
             
             # Obtener columnas de interés
             columnas_interes = get_columns_of_interest()
@@ -803,14 +708,14 @@ def register_callbacks(app):
             return [{'label': 'Equipo', 'value': 'Equipo'}]
         
         try:
-            df_fecha, formatted_date = format_and_filter_date(selected_date)
+            sesion = resumen_sesion(selected_date)
             
-            if df_fecha is None or df_fecha.height == 0:
+            if sesion is None or not sesion['jugadores']:
                 return [{'label': 'Equipo', 'value': 'Equipo'}]
             
-            # Obtener valores únicos de jugadores y posiciones
-            players = sorted(df_fecha.select('Player').unique().to_series().to_list())
-            positions = sorted(df_fecha.select('Position').unique().to_series().to_list())
+            # Jugadores y posiciones de la sesión, del índice de sesiones
+            players = sorted(sesion['jugadores'])
+            positions = sorted(sesion['posiciones'])
             
             # Crear opciones del dropdown
             options = [{'label': 'Equipo', 'value': 'Equipo'}]
@@ -843,7 +748,7 @@ def register_callbacks(app):
         
         try:
             # Convertir fecha al formato correcto
-            df_fecha, formatted_date = format_and_filter_date(selected_date)
+            df_fecha, formatted_date = format_and_filter_date(selected_date, ['Match Day'])
             
             # Obtener columnas de interés
             columnas_interes = get_columns_of_interest()
@@ -902,7 +807,7 @@ def register_callbacks(app):
         
         try:
             # Convertir fecha al formato correcto para calcular_estadisticas
-            df_fecha, formatted_date = format_and_filter_date(selected_date)
+            df_fecha, formatted_date = format_and_filter_date(selected_date, ['Match Day'])
             # Obtener columnas de interés
             columnas_interes = get_columns_of_interest()
             
@@ -1162,22 +1067,6 @@ def register_callbacks(app):
             if not selected_date:
                 return [empty_fig] * 6
             
-            # Obtener datos filtrados usando la función auxiliar existente
-            path_to_parquet = os.path.join(DATA_GPS_PATH, 'df_gps.parquet')
-            if not os.path.exists(path_to_parquet):
-                print(f"Archivo parquet no existe: {path_to_parquet}")
-                return None
-        
-            df = pl.read_parquet(path_to_parquet)
-            
-            df_fecha, formatted_date = format_and_filter_date(selected_date)
-            
-            if df_fecha is None or df_fecha.height == 0:
-                return [empty_fig] * 6
-            
-            # Convertir a pandas para facilitar manipulación
-            df_pandas = df_fecha.to_pandas()
-
             # Verificar si tenemos las columnas necesarias
             required_columns = [
                 'Player',
@@ -1195,6 +1084,20 @@ def register_callbacks(app):
                 'MAX Speed(km/h)'
             ]
             
+            # Obtener datos filtrados leyendo solo las columnas que usan los gráficos
+            if not existe_dataset():
+                print(f"Archivo parquet no existe: {os.path.join(DATA_GPS_PATH, 'df_gps.parquet')}")
+                return None
+            
+            resultado = format_and_filter_date(selected_date, required_columns + ['Position'])
+            
+            if resultado is None or resultado[0].height == 0:
+                return [empty_fig] * 6
+            df_fecha, formatted_date = resultado
+            
+            # Convertir a pandas para facilitar manipulación
+            df_pandas = df_fecha.to_pandas()
+            
             missing_columns = [col for col in required_columns if col not in df_pandas.columns]
             if missing_columns:
                 print(f"Columnas faltantes: {missing_columns}")
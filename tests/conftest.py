@@ -0,0 +1,24 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# Los tests trabajan sobre una carpeta de datos temporal: GPS_DATA_PATH se fija antes de importar utils
+RAIZ_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_TESTS = tempfile.mkdtemp(prefix='gps-tests-')
+os.environ['GPS_DATA_PATH'] = DATA_TESTS
+os.makedirs(os.path.join(DATA_TESTS, 'gps'))
+shutil.copy(os.path.join(RAIZ_REPO, 'data', 'gps', 'Columnas_interés.txt'), os.path.join(DATA_TESTS, 'gps'))
+sys.path.insert(0, RAIZ_REPO)
+
+
+@pytest.fixture
+def dataset_vacio():
+    """Carpeta de datos sin dataset ni estadísticas (conserva Columnas_interés.txt)"""
+    from utils import cache
+    for carpeta in ('gps/df_gps', 'processed', 'trabajos'):
+        shutil.rmtree(os.path.join(DATA_TESTS, carpeta), ignore_errors=True)
+    cache.limpiar_cache()
+    yield DATA_TESTS
@@ -0,0 +1,45 @@
+import datetime
+
+import polars as pl
+
+import conftest  # noqa: F401  (carpeta de datos temporal)
+
+
+def _filas(drills, distancias, titulos=None):
+    """Filas de un jugador en un mismo día, una por drill"""
+    df = pl.DataFrame({'Player': ['A'] * len(drills), 'Team ': ['Sporting'] * len(drills),
+                       'Date': [datetime.date(2023, 7, 3)] * len(drills), 'Selection': ['Drills'] * len(drills),
+                       'Match Day': ['MD-4'] * len(drills), 'Week Team': ['W1'] * len(drills),
+                       'Drills Duration': [float(d) for d in drills], 'Distance (m)': distancias})
+    if titulos is not None:
+        df = df.with_columns(pl.Series('Drill Title', titulos))
+    return df
+
+
+def _subir(df, archivo):
+    from utils.datos import agregar_particiones, descartar_filas_repetidas
+    (limpio,), solapes = descartar_filas_repetidas([(df.with_columns(pl.lit(archivo).alias('File Name')), archivo)])
+    agregar_particiones([limpio])
+    return solapes
+
+
+def test_drill_nuevo_de_un_dia_ya_cargado_sin_columna_de_drill(dataset_vacio):
+    from utils.datos import scan_gps
+    _subir(_filas([10], [500.0]), 'a.xlsx')
+    # El mismo drill otra vez y un segundo drill distinto del mismo jugador y día
+    solapes = _subir(_filas([10, 20], [500.0, 800.0]), 'b.xlsx')
+
+    assert sorted(scan_gps(['Distance (m)']).collect()['Distance (m)'].to_list()) == [500.0, 800.0]
+    assert [(solape['filas'], solape['clave']) for solape in solapes] == [(1, 'fila')]
+
+
+def test_drill_nuevo_de_un_dia_ya_cargado_con_columna_de_drill(dataset_vacio):
+    from utils.datos import scan_gps
+    _subir(_filas([10], [500.0], ['Rondo']), 'a.xlsx')
+    # El mismo drill con la distancia recalculada y un segundo drill del mismo día
+    solapes = _subir(_filas([10, 20], [505.0, 800.0], ['Rondo', 'Partido']), 'b.xlsx')
+
+    df = scan_gps(['Drill Title', 'Distance (m)']).collect().sort('Distance (m)')
+    assert df['Drill Title'].cast(pl.String).to_list() == ['Rondo', 'Partido']
+    assert df['Distance (m)'].to_list() == [500.0, 800.0]
+    assert [(solape['filas'], solape['clave']) for solape in solapes] == [(1, 'drill')]
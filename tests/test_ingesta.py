@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+from conftest import RAIZ_REPO
+
+# Script que, como python app.py, importa la aplicación en el proceso principal, deja un trabajo
+# en cola y lee varios Excel con el pool de leer_excels (cuyos procesos vuelven a importar el script)
+SCRIPT_LEER_EXCELS = textwrap.dedent('''
+    import io, os, sys
+    import polars as pl
+    import app
+    from utils import trabajos
+    from utils.ingesta import leer_excels
+
+    def eco(trabajo_id):
+        open(os.path.join(trabajos.DATA_TRABAJOS_PATH, 'reclamado-' + str(os.getpid())), 'w').close()
+
+    trabajos.registrar_tarea('eco', eco)
+
+    if __name__ == '__main__':
+        trabajo_id = trabajos.crear_trabajo('eco', None)
+        trabajos.actualizar_trabajo(trabajo_id, estado='en cola')
+        archivos = []
+        for numero in range(4):
+            buffer = io.BytesIO()
+            pl.DataFrame({'Player': ['A', 'B'], 'Distance (m)': [1.0, 2.0]}).write_excel(buffer)
+            archivos.append((buffer.getvalue(), f'{numero}.xlsx'))
+        resultados = leer_excels(archivos, workers=2)
+        assert all(df is not None and df.height == 2 for df, _, _ in resultados), resultados
+        print(trabajos.leer_trabajo(trabajo_id)['estado'])
+        print(sorted(nombre for nombre in os.listdir(trabajos.DATA_TRABAJOS_PATH) if nombre.startswith('reclamado-')))
+''')
+
+
+def test_procesos_de_leer_excels_no_reclaman_trabajos(dataset_vacio, tmp_path):
+    script = tmp_path / 'servidor.py'
+    script.write_text(SCRIPT_LEER_EXCELS)
+    entorno = dict(os.environ, PYTHONPATH=RAIZ_REPO)
+    resultado = subprocess.run([sys.executable, str(script)], env=entorno, cwd=RAIZ_REPO,
+                               capture_output=True, text=True, timeout=300)
+    assert resultado.returncode == 0, resultado.stderr
+    lineas = resultado.stdout.strip().splitlines()
+    # Nadie atiende peticiones: el trabajo sigue en cola y ningún proceso del pool lo ha ejecutado
+    assert lineas[-2:] == ['en cola', '[]']
+
+
+def test_columna_de_interes_nueva_tiene_datos_de_subidas_anteriores(dataset_vacio):
+    import io
+    import polars as pl
+    from utils import utils
+    from utils.datos import scan_gps
+    from utils.ingesta import incorporar_archivos, leer_excel
+
+    buffer = io.BytesIO()
+    pl.DataFrame({'Player': ['A'], 'Team ': ['Sporting'], 'Date': ['03/07/2023'], 'Selection': ['Drills'],
+                  'Distance (m)': [1.0], 'Columna nueva': [7.0]}).write_excel(buffer)
+    incorporar_archivos([(leer_excel(buffer.getvalue(), 'a.xlsx'), 'a.xlsx')])
+
+    # La columna no estaba en Columnas_interés.txt al subir el archivo, pero se guardó
+    assert 'Columna nueva' not in utils.cargar_columnas_interes()
+    assert scan_gps(['Columna nueva']).collect()['Columna nueva'].to_list() == [7.0]
@@ -0,0 +1,111 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+# Número máximo de resultados de estadísticas por semana guardados en memoria
+MAX_ENTRADAS_SEMANA = 32
+
+# Caché LRU de estadísticas por semana: clave -> (df_jugadores, df_position, df_team)
+_cache_semanas = OrderedDict()
+_bloqueo_cache = threading.Lock()
+
+# Cálculos en curso por clave, para que peticiones concurrentes esperen al primero
+_calculos_en_curso = {}
+
+
+def obtener_o_calcular(clave, calcular):
+    """
+    Devuelve el resultado cacheado para la clave o lo calcula con calcular().
+    Si varias peticiones piden la misma clave a la vez, solo una calcula y el resto espera su resultado.
+    """
+    with _bloqueo_cache:
+        if clave in _cache_semanas:
+            _cache_semanas.move_to_end(clave)
+            return _cache_semanas[clave]
+        bloqueo_clave = _calculos_en_curso.setdefault(clave, threading.Lock())
+
+    with bloqueo_clave:
+        # Otra petición pudo terminar el cálculo mientras esperábamos
+        with _bloqueo_cache:
+            if clave in _cache_semanas:
+                _cache_semanas.move_to_end(clave)
+                return _cache_semanas[clave]
+
+        try:
+            valor = calcular()
+            with _bloqueo_cache:
+                _cache_semanas[clave] = valor
+                while len(_cache_semanas) > MAX_ENTRADAS_SEMANA:
+                    _cache_semanas.popitem(last=False)
+            return valor
+        finally:
+            with _bloqueo_cache:
+                _calculos_en_curso.pop(clave, None)
+
+
+# ============================================================================
+# BASE FILTRADA EN MEMORIA
+# ============================================================================
+# Un único DataFrame compartido por todo el proceso (p. ej. los datos GPS con los filtros
+# comunes ya aplicados) asociado a una versión. Se vuelve a cargar solo cuando cambia la
+# versión y nunca se guarda si supera MAX_MB_BASE; en ese caso quien lo pide lee de disco.
+
+# Límite de memoria de la base filtrada en MB (GPS_CACHE_MB permite cambiarlo)
+MAX_MB_BASE = float(os.environ.get('GPS_CACHE_MB', 1024))
+
+_base = {'version': None, 'df': None}
+_bloqueo_base = threading.Lock()
+_contadores_base = {'aciertos': 0, 'fallos': 0, 'omitidas': 0}
+
+
+def obtener_base(version, cargar, estimar_mb=None):
+    """
+    Devuelve el DataFrame de la versión indicada, cargándolo con cargar() solo si la versión cambió.
+    estimar_mb() (opcional) da una cota de la memoria que ocupará antes de cargar, para no leer datos
+    que no caben; si no se indica o devuelve None, se comprueba el tamaño real después de cargar.
+    Devuelve None si no cabe en MAX_MB_BASE; no se vuelve a intentar hasta que cambie la versión.
+    """
+    if version is None:
+        return None
+    # Con el bloqueo tomado durante la carga, peticiones simultáneas esperan a la primera
+    with _bloqueo_base:
+        if _base['version'] == version:
+            if _base['df'] is None:
+                _contadores_base['omitidas'] += 1
+                return None
+            _contadores_base['aciertos'] += 1
+            return _base['df']
+
+        _contadores_base['fallos'] += 1
+        # Liberar la versión anterior antes de cargar la nueva
+        _base['version'], _base['df'] = None, None
+        df = None
+        estimacion = estimar_mb() if estimar_mb is not None else None
+        if estimacion is None or estimacion <= MAX_MB_BASE:
+            df = cargar()
+            if estimacion is None and df.estimated_size('mb') > MAX_MB_BASE:
+                df = None
+        if df is None:
+            _contadores_base['omitidas'] += 1
+        _base['version'], _base['df'] = version, df
+        return df
+
+
+def estado_cache():
+    """Aciertos, fallos y omisiones (por el límite de memoria) de la base filtrada y ocupación de ambas cachés"""
+    with _bloqueo_base:
+        estado = dict(_contadores_base)
+        estado['base_mb'] = _base['df'].estimated_size('mb') if _base['df'] is not None else 0.0
+        estado['max_mb_base'] = MAX_MB_BASE
+    with _bloqueo_cache:
+        estado['entradas_semana'] = len(_cache_semanas)
+    return estado
+
+
+def limpiar_cache():
+    """Vacía la caché de estadísticas por semana y la base filtrada"""
+    with _bloqueo_cache:
+        _cache_semanas.clear()
+    with _bloqueo_base:
+        _base['version'], _base['df'] = None, None
@@ -0,0 +1,852 @@
+import polars as pl
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo se excluyen entre sí los hilos del mismo proceso
+    fcntl = None
+
+from utils.cache import obtener_base
+
+
+# Obtener la ruta base del proyecto basada en la ubicación de este archivo
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Carpeta de datos (gps, processed...). GPS_DATA_PATH permite usar otra, p. ej. en los benchmarks
+DATA_PATH = os.environ.get('GPS_DATA_PATH', os.path.join(BASE_PATH, 'data'))
+DATA_GPS_PATH = os.path.join(DATA_PATH, 'gps')
+
+# ============================================================================
+# ACCESO A LOS DATOS GPS
+# ============================================================================
+# Todas las lecturas de los datos GPS pasan por este módulo. Se usa pl.scan_parquet
+# para que los filtros (Date, Week Team, Selection, Rehab...) y la selección de
+# columnas se apliquen al leer, y solo se descompriman los row groups y columnas necesarios.
+#
+# Los datos se guardan como un dataset particionado en data/gps/df_gps/: un parquet por
+# archivo subido y un manifest.json con la lista de particiones. Subir un archivo solo
+# escribe su partición y reescribe el manifest (un archivo pequeño, de forma atómica);
+# los lectores ven todas las particiones del manifest como una única tabla.
+# Si todavía existe el df_gps.parquet consolidado antiguo, se lee tal cual y se
+# migra al dataset particionado en la primera escritura.
+#
+# Cada escritura publica una versión nueva (número creciente en el manifest) y guarda una
+# copia del manifest en data/gps/df_gps/versiones/. Los parquet nunca se sobrescriben (el
+# nombre lleva la versión en que se escribieron) y solo se borran cuando ninguna de las
+# últimas VERSIONES_CONSERVADAS versiones los usa, así que volver a una de ellas
+# (restaurar_version) es publicar otra vez su manifest, sin copiar datos.
+
+DATASET_GPS_PATH = os.path.join(DATA_GPS_PATH, 'df_gps')
+DATASET_VERSIONES_PATH = os.path.join(DATASET_GPS_PATH, 'versiones')
+
+# Número de versiones del dataset a las que se puede volver
+VERSIONES_CONSERVADAS = 10
+
+# Esquema canónico de las particiones: identificadores como Categorical (con la caché global
+# de cadenas, para poder unir y concatenar particiones distintas) y métricas como Float64.
+# Se aplica una vez al escribir cada archivo, así las particiones ya encajan al leerlas juntas.
+COLUMNAS_CATEGORICAS = ['Player', 'Position', 'Team ', 'Match Day', 'Selection', 'Week Team', 'File Name']
+pl.enable_string_cache()
+
+# Filas por row group de cada partición. Las particiones se guardan ordenadas por Date, así que
+# las estadísticas min/max de cada row group permiten saltar los que no contienen la fecha buscada
+FILAS_POR_ROW_GROUP = 16384
+
+def ruta_gps():
+    """Ruta del parquet consolidado antiguo (anterior al dataset particionado)"""
+    return os.path.join(DATA_GPS_PATH, 'df_gps.parquet')
+
+def ruta_manifest():
+    """Ruta del manifest del dataset particionado"""
+    return os.path.join(DATASET_GPS_PATH, 'manifest.json')
+
+def leer_manifest(ruta=None):
+    """
+    Manifest del dataset ({'version', 'fecha', 'particiones': [{'archivo', 'ruta', 'filas', ...}, ...]})
+    o None si no existe. Con ruta se lee otro manifest (p. ej. el de una versión guardada).
+    Cada partición es también la entrada del catálogo de su archivo (ver catalogo_archivos).
+    """
+    try:
+        with open(ruta or ruta_manifest(), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def rutas_particiones():
+    """Rutas de los parquet que forman el dataset, en orden de subida"""
+    manifest = leer_manifest()
+    if manifest is not None:
+        return [os.path.join(DATASET_GPS_PATH, particion['ruta']) for particion in manifest['particiones']]
+    # Parquet consolidado antiguo todavía sin migrar
+    if os.path.exists(ruta_gps()) and os.path.getsize(ruta_gps()) > 0:
+        return [ruta_gps()]
+    return []
+
+def archivos_dataset():
+    """Nombres de los archivos subidos, leídos del manifest (sin abrir los datos)"""
+    manifest = leer_manifest()
+    if manifest is not None:
+        return [particion['archivo'] for particion in manifest['particiones']]
+    if rutas_particiones():
+        return scan_gps(['File Name']).unique(maintain_order=True).collect()['File Name'].to_list()
+    return []
+
+def _resumen_archivo(lf):
+    """Rango de fechas (texto ISO) y número de jugadores (sin las filas TEAM) de los datos de un archivo"""
+    columnas = lf.collect_schema().names()
+    expresiones = []
+    if 'Date' in columnas:
+        expresiones += [pl.col('Date').min().cast(pl.String).alias('desde'), pl.col('Date').max().cast(pl.String).alias('hasta')]
+    if 'Player' in columnas:
+        expresiones.append(pl.col('Player').filter(pl.col('Player') != 'TEAM').n_unique().alias('jugadores'))
+    return lf.select(expresiones).collect().row(0, named=True) if expresiones else {}
+
+def catalogo_archivos():
+    """
+    Catálogo de los archivos subidos, en orden de subida, leído del manifest (sin abrir los datos):
+    archivo, filas, desde y hasta (date), jugadores, hash_archivo (sha256 del archivo subido,
+    si se guardó) y subido (fecha y hora).
+    Las particiones escritas antes del catálogo se completan leyendo solo sus columnas Date y Player.
+    """
+    manifest = leer_manifest()
+    if manifest is None:
+        # Parquet consolidado antiguo: un resumen por 'File Name'
+        if not existe_dataset() or 'File Name' not in columnas_dataset():
+            return []
+        lf = scan_gps().with_columns(pl.col('File Name').cast(pl.String))
+        particiones = [{'archivo': archivo, 'filas': lf.filter(pl.col('File Name') == archivo).select(pl.len()).collect().item(),
+                        **_resumen_archivo(lf.filter(pl.col('File Name') == archivo))}
+                       for archivo in archivos_dataset()]
+    else:
+        particiones = [particion if 'desde' in particion else
+                       {**particion, **_resumen_archivo(normalizar_fechas(pl.scan_parquet(os.path.join(DATASET_GPS_PATH, particion['ruta']))))}
+                       for particion in manifest['particiones']]
+
+    catalogo = []
+    for particion in particiones:
+        subido = particion.get('subido')
+        catalogo.append({'archivo': particion['archivo'], 'filas': particion['filas'],
+                         'desde': a_fecha(particion.get('desde')), 'hasta': a_fecha(particion.get('hasta')),
+                         'jugadores': particion.get('jugadores'), 'hash_archivo': particion.get('hash_archivo'),
+                         'subido': datetime.datetime.fromisoformat(subido) if subido else None})
+    return catalogo
+
+def existe_dataset():
+    """Indica si hay datos GPS (al menos una partición)"""
+    return len(rutas_particiones()) > 0
+
+def version_dataset():
+    """
+    Número de versión del dataset; cambia con cada subida, eliminación o restauración y nunca se repite.
+    Para un manifest anterior a las versiones o el parquet antiguo se usa el mtime y tamaño del archivo.
+    """
+    manifest = leer_manifest()
+    if manifest is not None and 'version' in manifest:
+        return manifest['version']
+    ruta = ruta_manifest() if manifest is not None else ruta_gps()
+    try:
+        info = os.stat(ruta)
+    except OSError:
+        return None
+    return (info.st_mtime_ns, info.st_size)
+
+def columnas_dataset():
+    """Nombres de las columnas del dataset, leídos solo de los metadatos"""
+    return scan_gps().collect_schema().names()
+
+def a_fecha(valor):
+    """Convierte una fecha (date, datetime, 'dd/mm/aaaa' o 'aaaa-mm-dd') a datetime.date; None si no se reconoce"""
+    if isinstance(valor, datetime.datetime):
+        return valor.date()
+    if isinstance(valor, datetime.date):
+        return valor
+    for formato in ('%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(str(valor), formato).date()
+        except ValueError:
+            continue
+    return None
+
+def normalizar_fechas(df):
+    """
+    Convierte la columna Date a pl.Date (DataFrame o LazyFrame). Los Excel la traen como texto
+    dd/mm/aaaa o como fecha y hora; las particiones nuevas ya se guardan como pl.Date.
+    """
+    tipo = df.collect_schema().get('Date')
+    if tipo == pl.String:
+        return df.with_columns(pl.col('Date').str.to_date('%d/%m/%Y', strict=False))
+    if isinstance(tipo, pl.Datetime):
+        return df.with_columns(pl.col('Date').dt.date())
+    return df
+
+def aplicar_esquema(df):
+    """Aplica el esquema canónico: Date como pl.Date, identificadores Categorical y columnas numéricas Float64"""
+    df = normalizar_fechas(df)
+    esquema = df.collect_schema()
+    return df.with_columns(
+        [pl.col(col).cast(pl.String).cast(pl.Categorical) for col in COLUMNAS_CATEGORICAS if col in esquema] +
+        [pl.col(col).cast(pl.Float64) for col, tipo in esquema.items()
+         if tipo.is_numeric() and col not in COLUMNAS_CATEGORICAS]
+    )
+
+def scan_gps(columnas=None):
+    """
+    LazyFrame sobre el dataset GPS (todas las particiones como una tabla). Si se indican
+    columnas, solo se leen esas (las que no existan en el dataset se ignoran).
+    """
+    lf = _scan_rutas(rutas_particiones())
+    if columnas is not None:
+        disponibles = lf.collect_schema().names()
+        lf = lf.select([col for col in dict.fromkeys(columnas) if col in disponibles])
+    return lf
+
+def _scan_rutas(rutas):
+    """LazyFrame que concatena los parquet indicados"""
+    if not rutas:
+        return pl.LazyFrame()
+    # Los archivos pueden no tener exactamente las mismas columnas ni tipos
+    scans = [normalizar_fechas(pl.scan_parquet(ruta)) for ruta in rutas]
+    return pl.concat(scans, how='diagonal_relaxed') if len(scans) > 1 else scans[0]
+
+# ============================================================================
+# BLOQUEO DE ESCRITURA
+# ============================================================================
+# Con varios workers (gunicorn) dos subidas, o una subida y una edición, podrían leer y
+# reescribir el manifest, las estadísticas o el historial a la vez y perder una de las dos.
+# Toda modificación se hace dentro de escritura_exclusiva(): un flock sobre
+# data/gps/.escritura.lock (entre procesos) más un RLock (entre hilos del proceso).
+# Es reentrante, así que las funciones que escriben se pueden llamar unas a otras.
+# Los lectores no lo toman: cada archivo se publica con os.replace y siempre ven una
+# versión completa, la anterior o la nueva. Si un lector tiene que guardar algo que falta
+# (p. ej. el índice de sesiones de una partición nueva) lo hace dentro del bloqueo.
+
+_bloqueo_escritura = threading.RLock()
+_escritura = {'nivel': 0, 'archivo': None}
+
+def _reiniciar_bloqueo_tras_fork():
+    """
+    Un proceso hijo hereda el RLock tal como estaba: si otro hilo del padre lo tenía tomado, en el
+    hijo quedaría tomado para siempre. El hijo empieza con un bloqueo nuevo y cierra su copia del
+    archivo de bloqueo sin LOCK_UN (el flock es del padre, que lo sigue teniendo).
+    """
+    global _bloqueo_escritura
+    _bloqueo_escritura = threading.RLock()
+    if _escritura['archivo'] is not None:
+        _escritura['archivo'].close()
+    _escritura['nivel'], _escritura['archivo'] = 0, None
+
+os.register_at_fork(after_in_child=_reiniciar_bloqueo_tras_fork)
+
+def ruta_bloqueo():
+    """Ruta del archivo de bloqueo de escritura del dataset"""
+    return os.path.join(DATA_GPS_PATH, '.escritura.lock')
+
+@contextmanager
+def escritura_exclusiva():
+    """Garantiza un único escritor (entre hilos y procesos) mientras dura el bloque; sirve también como decorador"""
+    with _bloqueo_escritura:
+        if _escritura['nivel'] == 0 and fcntl is not None:
+            os.makedirs(DATA_GPS_PATH, exist_ok=True)
+            archivo = open(ruta_bloqueo(), 'a')
+            fcntl.flock(archivo, fcntl.LOCK_EX)
+            _escritura['archivo'] = archivo
+        _escritura['nivel'] += 1
+        try:
+            yield
+        finally:
+            _escritura['nivel'] -= 1
+            if _escritura['nivel'] == 0 and _escritura['archivo'] is not None:
+                fcntl.flock(_escritura['archivo'], fcntl.LOCK_UN)
+                _escritura['archivo'].close()
+                _escritura['archivo'] = None
+
+def escribir_parquet_atomico(df, ruta, **opciones):
+    """
+    Escribe un parquet de forma atómica: primero en un temporal con nombre único en la misma
+    carpeta y después os.replace. Los lectores ven el archivo anterior o el nuevo completo, y
+    dos escritores nunca comparten el temporal.
+    """
+    carpeta = os.path.dirname(ruta)
+    os.makedirs(carpeta, exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(dir=carpeta, prefix=os.path.basename(ruta) + '.', suffix='.tmp')
+    os.close(descriptor)
+    try:
+        df.write_parquet(temporal, **opciones)
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+# ============================================================================
+# ESCRITURA DEL DATASET PARTICIONADO
+# ============================================================================
+
+def _nombre_particion(archivo, version):
+    """Nombre del parquet de la partición de un archivo subido en una versión"""
+    return f"archivo={quote(str(archivo), safe='')}.v{version}.parquet"
+
+def _ruta_version(version):
+    """Ruta de la copia del manifest de una versión"""
+    return os.path.join(DATASET_VERSIONES_PATH, f"manifest-{version:06d}.json")
+
+def _versiones_guardadas():
+    """Números de las versiones con manifest guardado, en orden creciente"""
+    try:
+        nombres = os.listdir(DATASET_VERSIONES_PATH)
+    except OSError:
+        return []
+    return sorted(int(nombre[len('manifest-'):-len('.json')]) for nombre in nombres
+                  if nombre.startswith('manifest-') and nombre.endswith('.json'))
+
+def _siguiente_version():
+    """Número de la próxima versión del dataset"""
+    actual = (leer_manifest() or {}).get('version', 0)
+    return max([actual] + _versiones_guardadas()) + 1
+
+def _escribir_json(datos, ruta):
+    with open(ruta + '.tmp', 'w') as f:
+        json.dump(datos, f, indent=2)
+    os.replace(ruta + '.tmp', ruta)
+
+def _escribir_manifest(particiones, version, origen=None):
+    """
+    Publica una versión nueva del dataset: guarda su manifest en versiones/ y sustituye el manifest
+    actual de forma atómica (los lectores ven el anterior o el nuevo, nunca uno a medias).
+    Después borra las versiones antiguas y los parquet que ya no usa ninguna versión conservada.
+    """
+    os.makedirs(DATASET_VERSIONES_PATH, exist_ok=True)
+    manifest = {'version': version, 'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+                'particiones': particiones}
+    if origen is not None:
+        manifest['origen'] = origen
+    _escribir_json(manifest, _ruta_version(version))
+    _escribir_json(manifest, ruta_manifest())
+    _limpiar_versiones()
+    return version
+
+def _limpiar_versiones():
+    """Conserva las últimas VERSIONES_CONSERVADAS versiones y borra los parquet que no usa ninguna"""
+    versiones = _versiones_guardadas()
+    for version in versiones[:-VERSIONES_CONSERVADAS]:
+        os.remove(_ruta_version(version))
+
+    en_uso = set(particion['ruta'] for particion in (leer_manifest() or {'particiones': []})['particiones'])
+    for version in versiones[-VERSIONES_CONSERVADAS:]:
+        manifest = leer_manifest(_ruta_version(version))
+        if manifest is None:
+            # Sin poder leer una versión no se sabe qué usa: mejor no borrar nada
+            return
+        en_uso.update(particion['ruta'] for particion in manifest['particiones'])
+    for nombre in os.listdir(DATASET_GPS_PATH):
+        if nombre.startswith('archivo=') and nombre.endswith('.parquet') and nombre not in en_uso:
+            os.remove(os.path.join(DATASET_GPS_PATH, nombre))
+        elif nombre.startswith('archivo=') and nombre.endswith('.arrow') and _particion_de_copia(nombre) not in en_uso:
+            # Copia Arrow de una partición que ya no usa ninguna versión
+            os.remove(os.path.join(DATASET_GPS_PATH, nombre))
+        elif nombre.startswith('base-') and nombre.endswith('.arrow'):
+            # Copia completa de la base de versiones anteriores (antes de las copias por partición)
+            os.remove(os.path.join(DATASET_GPS_PATH, nombre))
+
+def _escribir_particion(df, archivo, version, huella=None):
+    """
+    Escribe la partición de un archivo y devuelve su entrada del manifest y su índice de sesiones.
+    huella es la del archivo subido tal cual (huella_archivo), si se conoce.
+    """
+    os.makedirs(DATASET_GPS_PATH, exist_ok=True)
+    nombre = _nombre_particion(archivo, version)
+    ruta = os.path.join(DATASET_GPS_PATH, nombre)
+    # Esquema canónico, Date ordenada y estadísticas por row group para que los filtros por fecha salten el resto
+    df = aplicar_esquema(df)
+    if 'Date' in df.columns:
+        df = df.sort('Date', maintain_order=True)
+    df.write_parquet(ruta + '.tmp', statistics=True, row_group_size=FILAS_POR_ROW_GROUP)
+    os.replace(ruta + '.tmp', ruta)
+
+    # Entrada del manifest, que sirve también de catálogo de archivos
+    entrada = {'archivo': archivo, 'ruta': nombre, 'filas': df.height, **_resumen_archivo(df.lazy()),
+               'subido': datetime.datetime.now().isoformat(timespec='seconds')}
+    if huella is not None:
+        entrada['hash_archivo'] = huella
+    return entrada, _indice_particion(df, archivo, nombre)
+
+def huella_archivo(contenido):
+    """sha256 de un archivo subido tal cual (bytes o ruta), sin leerlo como Excel"""
+    huella = hashlib.sha256()
+    if isinstance(contenido, bytes):
+        huella.update(contenido)
+    else:
+        with open(contenido, 'rb') as f:
+            for bloque in iter(lambda: f.read(1024 * 1024), b''):
+                huella.update(bloque)
+    return huella.hexdigest()
+
+def huellas_archivos():
+    """Diccionario huella del archivo subido -> nombre del archivo, de las particiones que la guardan"""
+    manifest = leer_manifest() or {'particiones': []}
+    return {particion['hash_archivo']: particion['archivo'] for particion in manifest['particiones'] if 'hash_archivo' in particion}
+
+# ============================================================================
+# FILAS REPETIDAS ENTRE ARCHIVOS
+# ============================================================================
+# Dos exports con fechas que se solapan (o el mismo export con otro nombre) traen las mismas filas.
+# Si el export trae el drill o su hora de inicio (COLUMNAS_DRILL), cada fila se identifica por su
+# clave natural (jugador, equipo, fecha, Selection) más esas columnas, así que una fila con alguna
+# métrica recalculada cuenta como repetida. Si no las trae, la clave natural no distingue los
+# drills de un mismo día y se compara la fila completa: un drill nuevo de un día ya cargado se
+# añade, aunque una fila recalculada también. Las filas nuevas cuya clave ya está en el dataset se
+# descartan comparando el hash de la clave con el de las particiones cuyo rango de fechas se
+# solapa con el del archivo (el resto no se abre). Los hashes se calculan en cada subida y no se
+# guardan, porque el hash de polars puede cambiar entre versiones.
+
+CLAVE_NATURAL = ['Player', 'Team ', 'Date', 'Selection']
+
+# Columnas con el drill o la hora de inicio de cada fila. Los exports de ejemplo no traen ninguna:
+# si el proveedor las incluye con otro nombre hay que añadirlo aquí.
+COLUMNAS_DRILL = ['Drill Title', 'Drill', 'Start Time', 'Drill Start Time']
+
+def _columnas_clave(columnas):
+    """
+    Columnas que identifican una fila entre las columnas indicadas (las comunes al archivo nuevo
+    y a la partición con la que se compara) y si son la clave natural con el drill ('drill') o
+    la fila completa ('fila'), cuando ninguna columna de COLUMNAS_DRILL está en las dos.
+    """
+    if not any(col in columnas for col in COLUMNAS_DRILL):
+        return [col for col in columnas if col != 'File Name'], 'fila'
+    return [col for col in CLAVE_NATURAL + COLUMNAS_DRILL if col in columnas], 'drill'
+
+
+def _hash_clave(columnas):
+    """Expresión con el hash (UInt64) de la clave de cada fila de unos datos con el esquema canónico"""
+    return pl.struct([pl.col(col).cast(pl.String) if col in COLUMNAS_CATEGORICAS else pl.col(col)
+                      for col in columnas]).hash()
+
+def descartar_filas_repetidas(archivos):
+    """
+    Quita de cada archivo ([(df, archivo), ...]) las filas que ya están en el dataset o en un
+    archivo anterior del mismo lote. Devuelve ([(df con el esquema canónico y sin repetidas, archivo), ...],
+    [solapes]), donde cada solape es {'archivo', 'con', 'filas', 'clave', 'desde', 'hasta'} (fechas date;
+    clave es 'drill' o 'fila', ver _columnas_clave).
+    """
+    manifest = leer_manifest() or {'particiones': []}
+    previos = [(particion['archivo'], pl.scan_parquet(os.path.join(DATASET_GPS_PATH, particion['ruta'])),
+                a_fecha(particion.get('desde')), a_fecha(particion.get('hasta')))
+               for particion in manifest['particiones']]
+
+    resultado = []
+    solapes = []
+    for df, archivo in archivos:
+        df = aplicar_esquema(df)
+        desde, hasta = (df['Date'].min(), df['Date'].max()) if 'Date' in df.columns and df.height > 0 else (None, None)
+        repetidas = pl.Series([False] * df.height)
+        for nombre, lf, previo_desde, previo_hasta in previos:
+            # Solo se abren los archivos cuyo rango de fechas se solapa con el nuevo
+            if None not in (desde, hasta, previo_desde, previo_hasta) and (previo_hasta < desde or previo_desde > hasta):
+                continue
+            esquema = lf.collect_schema()
+            clave, tipo_clave = _columnas_clave([col for col in df.columns if col in esquema])
+            if not clave:
+                continue
+            # Mismos tipos que el archivo nuevo aunque la partición se escribiera antes del esquema canónico
+            lf = aplicar_esquema(lf)
+            if desde is not None and 'Date' in esquema:
+                lf = lf.filter(pl.col('Date').is_between(desde, hasta))
+            existentes = lf.select(_hash_clave(clave).alias('clave')).collect()['clave']
+            en_previo = df.select(_hash_clave(clave).is_in(existentes.implode())).to_series()
+            nuevas_repetidas = en_previo & ~repetidas
+            if nuevas_repetidas.any():
+                fechas = df.filter(nuevas_repetidas)['Date'] if 'Date' in df.columns else None
+                solapes.append({'archivo': archivo, 'con': nombre, 'filas': int(nuevas_repetidas.sum()), 'clave': tipo_clave,
+                                'desde': fechas.min() if fechas is not None else None,
+                                'hasta': fechas.max() if fechas is not None else None})
+            repetidas = repetidas | en_previo
+        df = df.filter(~repetidas)
+        resultado.append((df, archivo))
+        # Los siguientes archivos del lote también se comparan con este
+        previos.append((archivo, df.lazy(), desde, hasta))
+    return resultado, solapes
+
+@escritura_exclusiva()
+def migrar_dataset_antiguo():
+    """Convierte el df_gps.parquet consolidado antiguo en el dataset particionado (una sola vez)"""
+    if leer_manifest() is not None or not os.path.exists(ruta_gps()):
+        return
+    escribir_dataset(pl.read_parquet(ruta_gps()) if os.path.getsize(ruta_gps()) > 0 else pl.DataFrame())
+    print("df_gps.parquet migrado al dataset particionado")
+
+def _retirar_dataset_antiguo():
+    """Renombra el df_gps.parquet antiguo una vez publicado el manifest (se conserva por si hiciera falta volver atrás)"""
+    if os.path.exists(ruta_gps()):
+        os.replace(ruta_gps(), ruta_gps() + '.migrado')
+
+def agregar_particion(df, archivo):
+    """Añade los datos de un archivo subido como una nueva partición del dataset"""
+    return agregar_particiones([(df, archivo)])[0]
+
+@escritura_exclusiva()
+def agregar_particiones(archivos, huellas=None):
+    """
+    Añade varios archivos subidos ([(df, archivo), ...]) como particiones nuevas publicadas
+    en una sola versión del dataset. huellas ({archivo: huella_archivo}) se guarda en el manifest
+    para reconocer después el mismo archivo sin leerlo. Devuelve sus entradas del manifest.
+    """
+    migrar_dataset_antiguo()
+    manifest = leer_manifest() or {'particiones': []}
+    version = _siguiente_version()
+    huellas = huellas or {}
+    escritas = []
+    try:
+        for df, archivo in archivos:
+            escritas.append(_escribir_particion(df, archivo, version, huellas.get(archivo)))
+        _escribir_manifest(manifest['particiones'] + [entrada for entrada, _ in escritas], version)
+    except Exception:
+        # Sin manifest las particiones no son visibles; se borran para no dejar restos
+        for entrada, _ in escritas:
+            os.remove(os.path.join(DATASET_GPS_PATH, entrada['ruta']))
+        raise
+    _escribir_indice_sesiones(pl.concat([_leer_indice_guardado()] + [indice for _, indice in escritas], how='diagonal_relaxed'))
+    publicar_copias_arrow()
+    return [entrada for entrada, _ in escritas]
+
+@escritura_exclusiva()
+def eliminar_particiones(archivos):
+    """
+    Elimina del dataset las particiones de los archivos indicados: solo se publica un manifest
+    sin ellas, sin leer ni reescribir el resto de los datos. Sus parquet se conservan mientras
+    alguna versión guardada los use.
+    Devuelve las filas eliminadas (para actualizar las estadísticas afectadas) o None si no había ninguna.
+    """
+    migrar_dataset_antiguo()
+    manifest = leer_manifest() or {'particiones': []}
+    quitar = [particion for particion in manifest['particiones'] if particion['archivo'] in archivos]
+    if not quitar:
+        return None
+
+    rutas = [os.path.join(DATASET_GPS_PATH, particion['ruta']) for particion in quitar]
+    df_eliminado = pl.concat([pl.scan_parquet(ruta) for ruta in rutas], how='diagonal_relaxed').collect()
+
+    _escribir_manifest([particion for particion in manifest['particiones'] if particion not in quitar],
+                       _siguiente_version())
+    _escribir_indice_sesiones(_leer_indice_guardado().filter(~pl.col('ruta').is_in([p['ruta'] for p in quitar])))
+    publicar_copias_arrow()
+    return df_eliminado
+
+@escritura_exclusiva()
+def escribir_dataset(df):
+    """
+    Reescribe el dataset completo a partir de un DataFrame, con una partición por 'File Name',
+    como una versión nueva. Las particiones anteriores se conservan mientras alguna versión guardada las use.
+    """
+    version = _siguiente_version()
+    escritas = [_escribir_particion(df_archivo, df_archivo['File Name'][0], version)
+                for df_archivo in df.partition_by('File Name', maintain_order=True)] if df.height > 0 else []
+    _escribir_manifest([entrada for entrada, _ in escritas], version)
+    _escribir_indice_sesiones(pl.concat([_indice_vacio()] + [indice for _, indice in escritas], how='diagonal_relaxed'))
+    _retirar_dataset_antiguo()
+    publicar_copias_arrow()
+
+def versiones_dataset():
+    """Versiones a las que se puede volver, de la más reciente a la más antigua: [{'version', 'fecha', 'archivos', 'filas'}]"""
+    versiones = []
+    for version in reversed(_versiones_guardadas()):
+        manifest = leer_manifest(_ruta_version(version))
+        if manifest is not None:
+            versiones.append({'version': version, 'fecha': manifest.get('fecha'),
+                              'archivos': [particion['archivo'] for particion in manifest['particiones']],
+                              'filas': sum(particion['filas'] for particion in manifest['particiones'])})
+    return versiones
+
+@escritura_exclusiva()
+def restaurar_version(version):
+    """
+    Vuelve a la versión indicada publicando otra vez su manifest como una versión nueva
+    (no se copia ningún dato). Devuelve el número de la versión nueva o None si no se puede.
+    Las estadísticas se tienen que recalcular después (python -m utils.reconstruir).
+    """
+    manifest = leer_manifest(_ruta_version(version))
+    if manifest is None:
+        print(f"La versión {version} del dataset no está entre las conservadas")
+        return None
+    faltan = [particion['archivo'] for particion in manifest['particiones']
+              if not os.path.exists(os.path.join(DATASET_GPS_PATH, particion['ruta']))]
+    if faltan:
+        print(f"No se puede restaurar la versión {version}: faltan las particiones de {', '.join(faltan)}")
+        return None
+    nueva = _escribir_manifest(manifest['particiones'], _siguiente_version(), origen=version)
+    publicar_copias_arrow()
+    return nueva
+
+# ============================================================================
+# COPIAS ARROW IPC DE LA BASE FILTRADA
+# ============================================================================
+# Con varios workers (gunicorn) cada proceso descomprimiría el parquet en su propia memoria.
+# Junto a cada partición se publica su copia archivo=<archivo>.v<N>.arrow: sus filas ya filtradas
+# (filtrar_datos_gps) en Arrow IPC sin comprimir, que los workers abren con memory_map y cuyas
+# páginas comparte la caché del sistema operativo. Las particiones no cambian nunca, así que cada
+# escritura solo copia las particiones nuevas (una eliminación o restauración no escribe nada) y
+# las copias se borran con su parquet. Si falta alguna copia se lee esa partición del parquet.
+
+# Publicar las copias de las particiones nuevas en cada escritura (innecesario con un solo worker)
+PUBLICAR_COPIA_ARROW = True
+
+def ruta_copia_arrow(particion):
+    """Ruta de la copia Arrow de una partición del manifest"""
+    return os.path.join(DATASET_GPS_PATH, os.path.splitext(particion['ruta'])[0] + '.arrow')
+
+def _particion_de_copia(nombre):
+    """Nombre del parquet de la partición a la que corresponde una copia Arrow"""
+    return os.path.splitext(nombre)[0] + '.parquet'
+
+def publicar_copias_arrow():
+    """Escribe las copias Arrow que falten de las particiones del manifest actual"""
+    manifest = leer_manifest()
+    if not PUBLICAR_COPIA_ARROW or manifest is None:
+        return
+    for particion in manifest['particiones']:
+        ruta = ruta_copia_arrow(particion)
+        if os.path.exists(ruta):
+            continue
+        descriptor, temporal = tempfile.mkstemp(dir=DATASET_GPS_PATH, prefix=os.path.basename(ruta) + '.', suffix='.tmp')
+        os.close(descriptor)
+        try:
+            lf = _scan_rutas([os.path.join(DATASET_GPS_PATH, particion['ruta'])])
+            filtrar_datos_gps(lf).sink_ipc(temporal, compression='uncompressed')
+            os.replace(temporal, ruta)
+        except Exception as e:
+            print(f"No se pudo publicar la copia Arrow de {particion['archivo']}: {str(e)}")
+            if os.path.exists(temporal):
+                os.remove(temporal)
+
+def filtrar_datos_gps(df):
+    """Descarta Rehab, filas TEAM y todo lo que no sea Drills, y normaliza el nombre del equipo (DataFrame o LazyFrame)"""
+    tipo_team = df.collect_schema()['Team ']
+    return (df.filter(pl.col('Match Day') != 'Rehab')
+              .filter(pl.col('Player') != 'TEAM')
+              .filter(pl.col('Team ') != 'TEAM')
+              .filter(pl.col('Selection') == 'Drills')
+              .with_columns(
+                  # str.contains no admite Categorical: se compara como texto y se conserva el tipo
+                  pl.when(pl.col('Team ').cast(pl.String).str.contains('Sporting'))
+                  .then(pl.lit('Sporting de Gijón'))
+                  .otherwise(pl.col('Team ').cast(pl.String))
+                  .cast(tipo_team)
+                  .alias('Team ')
+              ))
+
+def base_filtrada():
+    """
+    Datos GPS con los filtros comunes ya aplicados, compartidos en memoria por todo el proceso
+    hasta que cambie la versión del dataset. Las particiones con copia Arrow se abren con
+    memory_map; las demás se leen del parquet.
+    None si no hay datos o no caben en el límite de utils.cache.
+    """
+    if not existe_dataset():
+        return None
+    manifest = leer_manifest()
+    if manifest is None:
+        return obtener_base((version_dataset(), None), lambda: filtrar_datos_gps(scan_gps()).collect())
+
+    con_copia = [particion for particion in manifest['particiones'] if os.path.exists(ruta_copia_arrow(particion))]
+    sin_copia = [particion for particion in manifest['particiones'] if particion not in con_copia]
+
+    def cargar():
+        partes = [pl.read_ipc(ruta_copia_arrow(particion), memory_map=True) for particion in con_copia]
+        if sin_copia:
+            rutas = [os.path.join(DATASET_GPS_PATH, particion['ruta']) for particion in sin_copia]
+            partes.append(filtrar_datos_gps(_scan_rutas(rutas)).collect())
+        return pl.concat(partes, how='diagonal_relaxed', rechunk=False) if len(partes) > 1 else partes[0]
+
+    def estimar_mb():
+        # Las páginas mapeadas las comparte la caché del sistema operativo: no cuentan para el límite.
+        # Del resto, cota superior de 8 bytes por valor de las filas sin filtrar (Categorical ocupa 4, Float64 8)
+        filas = sum(particion['filas'] for particion in sin_copia)
+        return filas * len(columnas_dataset()) * 8 / 1e6
+
+    return obtener_base((version_dataset(), len(con_copia)), cargar, estimar_mb)
+
+def scan_sesiones(fecha=None, week_team=None, columnas=None, filtrar=True, en_memoria=False):
+    """
+    LazyFrame con los datos filtrados por fecha y/o Week Team.
+    Con filtrar=True se aplican además los filtros comunes (sin Rehab, sin TEAM, solo Drills).
+    Con en_memoria=True (y filtrar=True) se parte de base_filtrada() si está disponible en vez de leer de disco.
+    Las columnas usadas por los filtros se leen aunque no se pidan y se descartan al final.
+    """
+    base = base_filtrada() if filtrar and en_memoria else None
+    if base is not None:
+        lf = base.lazy()
+    else:
+        columnas_filtro = ['Date', 'Week Team', 'Match Day', 'Player', 'Team ', 'Selection']
+        lf = scan_gps(None if columnas is None else list(columnas) + columnas_filtro)
+
+    if fecha is not None:
+        lf = lf.filter(pl.col('Date') == a_fecha(fecha))
+    if week_team is not None:
+        lf = lf.filter(pl.col('Week Team') == week_team)
+    if filtrar and base is None:
+        lf = filtrar_datos_gps(lf)
+
+    if columnas is not None:
+        disponibles = lf.collect_schema().names()
+        lf = lf.select([col for col in dict.fromkeys(columnas) if col in disponibles])
+    return lf
+
+def leer_sesion(fecha, columnas=None, filtrar=True):
+    """
+    Lee los datos de una fecha (date o texto dd/mm/aaaa) leyendo solo las columnas pedidas.
+    Con filtrar=True se sirven desde la base filtrada en memoria cuando cabe en el límite.
+    """
+    if not existe_dataset():
+        return None
+    # Los identificadores se devuelven como texto: la interfaz los pasa a pandas y agrupa por ellos
+    return (scan_sesiones(fecha=fecha, columnas=columnas, filtrar=filtrar, en_memoria=True)
+            .with_columns(pl.col(pl.Categorical).cast(pl.String))
+            .collect())
+
+def fechas_disponibles():
+    """Fechas distintas presentes en el dataset (datetime.date, en orden cronológico), leídas del índice de sesiones"""
+    return sorted(sesiones_por_fecha())
+
+# ============================================================================
+# ÍNDICE DE SESIONES
+# ============================================================================
+# Tabla pequeña (data/gps/df_gps/sesiones.parquet) con una fila por partición y fecha:
+# rango de filas dentro de la partición (ordenada por Date), Match Day y Week Team de la sesión
+# (primera fila que no es Rehab) y Match Days, jugadores, posiciones y duración de las filas que
+# quedan tras filtrar_datos_gps. Se actualiza al escribir o eliminar particiones, así que el
+# selector de fechas y los paneles de la Session Report no tienen que leer los datos GPS.
+# Si al leerlo falta alguna partición del manifest (p. ej. un dataset anterior al índice),
+# se calcula a partir de esa partición y se vuelve a guardar.
+
+_ESQUEMA_INDICE = {'archivo': pl.String, 'ruta': pl.String, 'Date': pl.Date, 'fila_inicio': pl.Int64, 'filas': pl.Int64,
+                   'Match Day': pl.String, 'Week Team': pl.String, 'Match Days': pl.List(pl.String),
+                   'Jugadores': pl.List(pl.String), 'Posiciones': pl.List(pl.String)}
+
+# Índice en memoria: (versión del dataset, versión del índice) -> {fecha: resumen de la sesión}
+_indice_en_memoria = {'clave': None, 'sesiones': {}}
+
+def ruta_indice_sesiones():
+    """Ruta del índice de sesiones del dataset particionado"""
+    return os.path.join(DATASET_GPS_PATH, 'sesiones.parquet')
+
+def _indice_vacio():
+    return pl.DataFrame(schema=_ESQUEMA_INDICE)
+
+def _indice_particion(df, archivo, ruta):
+    """Índice de sesiones (una fila por fecha) de los datos de la partición de un archivo, ya ordenados por Date"""
+    necesarias = ['Date', 'Match Day', 'Week Team', 'Player', 'Position', 'Team ', 'Selection']
+    if df.height == 0 or any(col not in df.columns for col in necesarias):
+        return _indice_vacio()
+    df = df.with_columns(pl.col(pl.Categorical).cast(pl.String))
+
+    filas = (df.with_row_index('_fila')
+               .group_by('Date', maintain_order=True)
+               .agg(pl.col('_fila').min().cast(pl.Int64).alias('fila_inicio'), pl.len().cast(pl.Int64).alias('filas')))
+    sesion = (df.filter(pl.col('Match Day') != 'Rehab')
+                .group_by('Date', maintain_order=True)
+                .agg(pl.col('Match Day').first(), pl.col('Week Team').first().cast(pl.String)))
+    filtradas = filtrar_datos_gps(df)
+    detalle = filtradas.group_by('Date', maintain_order=True).agg(
+        pl.col('Match Day').unique(maintain_order=True).alias('Match Days'),
+        pl.col('Player').unique(maintain_order=True).alias('Jugadores'),
+        pl.col('Position').unique(maintain_order=True).alias('Posiciones'),
+        *([pl.col('Drills Duration').first()] if 'Drills Duration' in df.columns else []),
+    )
+    return (filas.join(sesion, on='Date', how='left')
+                 .join(detalle, on='Date', how='left')
+                 .with_columns(pl.lit(archivo, dtype=pl.String).alias('archivo'), pl.lit(ruta, dtype=pl.String).alias('ruta'))
+                 .select(list(_ESQUEMA_INDICE) + (['Drills Duration'] if 'Drills Duration' in detalle.columns else [])))
+
+def _leer_indice_guardado():
+    """Índice de sesiones tal como está guardado (vacío si no existe o es de un formato anterior)"""
+    try:
+        indice = pl.read_parquet(ruta_indice_sesiones())
+    except (OSError, pl.exceptions.PolarsError):
+        return _indice_vacio()
+    return indice if 'ruta' in indice.columns else _indice_vacio()
+
+@escritura_exclusiva()
+def _escribir_indice_sesiones(indice):
+    """Guarda el índice de sesiones de forma atómica (con el bloqueo de escritura tomado)"""
+    escribir_parquet_atomico(indice, ruta_indice_sesiones())
+
+def indice_sesiones():
+    """
+    Índice de sesiones de las particiones del manifest, en orden de subida.
+    Las particiones que no estén en el índice guardado se indexan leyéndolas y se guarda el resultado
+    (con el bloqueo de escritura tomado, volviendo a comprobar qué falta una vez dentro).
+    """
+    manifest = leer_manifest()
+    if manifest is None:
+        # Parquet consolidado antiguo: el índice se calcula al vuelo hasta que se migre
+        if not existe_dataset() or 'Date' not in columnas_dataset():
+            return _indice_vacio()
+        df = normalizar_fechas(scan_gps()).collect()
+        return _indice_particion(df.sort('Date', maintain_order=True), os.path.basename(ruta_gps()), os.path.basename(ruta_gps()))
+
+    orden = {particion['ruta']: posicion for posicion, particion in enumerate(manifest['particiones'])}
+    guardado = _leer_indice_guardado()
+    if not set(orden) <= set(guardado['ruta'].to_list()):
+        with escritura_exclusiva():
+            # Otro lector (o una escritura) puede haberlo completado mientras se esperaba el bloqueo
+            manifest = leer_manifest()
+            orden = {particion['ruta']: posicion for posicion, particion in enumerate(manifest['particiones'])}
+            guardado = _leer_indice_guardado()
+            indexadas = set(guardado['ruta'].to_list())
+            faltan = [particion for particion in manifest['particiones'] if particion['ruta'] not in indexadas]
+            if faltan:
+                # Solo se guardan las particiones del manifest actual (p. ej. tras restaurar una versión)
+                nuevos = [_indice_particion(normalizar_fechas(pl.read_parquet(os.path.join(DATASET_GPS_PATH, particion['ruta']))),
+                                            particion['archivo'], particion['ruta'])
+                          for particion in faltan]
+                guardado = pl.concat([guardado.filter(pl.col('ruta').is_in(list(orden)))] + nuevos, how='diagonal_relaxed')
+                _escribir_indice_sesiones(guardado)
+
+    return (guardado.filter(pl.col('ruta').is_in(list(orden)))
+                    .sort(pl.col('ruta').replace_strict(orden, return_dtype=pl.Int64), 'Date', maintain_order=True))
+
+def _clave_indice():
+    """Versión del dataset y del índice guardado (mtime y tamaño)"""
+    try:
+        info = os.stat(ruta_indice_sesiones())
+        return (version_dataset(), info.st_mtime_ns, info.st_size)
+    except OSError:
+        return (version_dataset(), None)
+
+def sesiones_por_fecha():
+    """
+    Resumen de cada sesión del dataset ({fecha: {...}}), combinando los archivos que tengan esa fecha:
+    'match_day' y 'week_team' de la sesión, 'match_days', 'jugadores' y 'posiciones' tras los filtros
+    comunes, 'duracion' (primera Drills Duration) y 'filas' (filas sin filtrar).
+    Se guarda en memoria mientras no cambien ni el dataset ni el índice.
+    """
+    clave = _clave_indice()
+    if clave[0] is not None and clave == _indice_en_memoria['clave']:
+        return _indice_en_memoria['sesiones']
+
+    indice = indice_sesiones()
+    sesiones = {}
+    for fila in indice.drop_nulls('Date').iter_rows(named=True):
+        sesion = sesiones.setdefault(fila['Date'], {'match_day': None, 'week_team': None, 'match_days': [],
+                                                    'jugadores': [], 'posiciones': [], 'duracion': None, 'filas': 0})
+        if sesion['match_day'] is None:
+            sesion['match_day'], sesion['week_team'] = fila['Match Day'], fila['Week Team']
+        if sesion['duracion'] is None:
+            sesion['duracion'] = fila.get('Drills Duration')
+        for campo, columna in [('match_days', 'Match Days'), ('jugadores', 'Jugadores'), ('posiciones', 'Posiciones')]:
+            sesion[campo] += [valor for valor in (fila[columna] or []) if valor not in sesion[campo]]
+        sesion['filas'] += fila['filas']
+
+    # El índice puede haberse reescrito al completarlo: la clave se toma después
+    _indice_en_memoria['clave'] = _clave_indice()
+    _indice_en_memoria['sesiones'] = sesiones
+    return sesiones
+
+def resumen_sesion(fecha):
+    """Resumen de la sesión de una fecha (date o texto) según sesiones_por_fecha(), o None si no hay datos"""
+    return sesiones_por_fecha().get(a_fecha(fecha))
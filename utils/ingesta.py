@@ -0,0 +1,186 @@
+import polars as pl
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.datos import (archivos_dataset, agregar_particiones, escritura_exclusiva, huella_archivo,
+                         huellas_archivos, descartar_filas_repetidas, COLUMNAS_DRILL)
+from utils.utils import actualizar_estadisticas, cargar_columnas_interes, COLUMNAS_CLAVE
+from utils.lectura_excel import leer_excel_seguro
+from utils import lectura_excel
+
+
+# ============================================================================
+# INGESTA DE ARCHIVOS GPS
+# ============================================================================
+# Lógica de la subida de archivos separada del callback de Dash (pages/cargar_datos.py)
+# para poder usarla también desde scripts y benchmarks.
+
+# La lectura de cada Excel está en utils/lectura_excel.py (lo único que importan los procesos del pool)
+
+# Leer solo las columnas que usa la aplicación en vez del export completo. Desactivado: los Excel no
+# se conservan, así que las columnas descartadas al leer se perderían y una columna añadida después a
+# Columnas_interés.txt no tendría datos de las subidas anteriores (ni con python -m utils.reconstruir).
+# Con todas las columnas guardadas, la proyección se hace al leer el dataset (scan_gps(columnas)
+# solo lee de cada parquet las columnas pedidas).
+PROYECTAR_COLUMNAS = False
+
+# Columnas que siempre se guardan además de las de interés: identificadores de la sesión
+COLUMNAS_IDENTIFICADORAS = COLUMNAS_CLAVE + ['Date', 'Drills Duration']
+
+# Zonas de velocidad y aceleración y velocidad máxima que dibujan los gráficos de pages/sessionReport.py
+COLUMNAS_GRAFICOS = [
+    'Speed Zones (m) [0.0, 45.0]% (m)', 'Speed Zones (m) [45.0, 65.0]% (m)',
+    'Speed Zones (m) [65.0, 75.0]% (m)', 'Speed Zones (m) [75.0, 85.0]% (m)',
+    'Speed Zones (m) [85.0, 95.0]% (m)', 'Speed Zones (m) [95.0, 100.0]% (m)',
+    'Acceleration Zones  [0, 50]% Cnt', 'Acceleration Zones  [50, 60]% Cnt',
+    'Acceleration Zones  [-50, 0]% Cnt', 'Acceleration Zones  [-60, -50]% Cnt',
+    'MAX Speed(km/h)'
+]
+
+def normalizar_nombre_archivo(filename):
+    """Renombra el archivo a "dd_mm_aaaa_al_dd_mm_aaaa.xlsx" si el nombre contiene dos fechas dd-mm-aaaa"""
+    match = re.search(r'(\d{2})-(\d{2})-(\d{4}).*?(\d{2})-(\d{2})-(\d{4})', filename)
+    if match:
+        day1, month1, year1, day2, month2, year2 = match.groups()
+        return f"{day1}_{month1}_{year1}_al_{day2}_{month2}_{year2}.xlsx"
+    return filename
+
+def columnas_necesarias():
+    """
+    Columnas del export que se leen: identificadores, drill y hora de inicio (clave de las filas
+    repetidas, ver utils/datos.py), Columnas_interés.txt y las de los gráficos
+    """
+    return set(COLUMNAS_IDENTIFICADORAS + COLUMNAS_DRILL + cargar_columnas_interes() + COLUMNAS_GRAFICOS)
+
+def columnas_leidas():
+    """Columnas que se leen de cada export (None: todas, ver PROYECTAR_COLUMNAS)"""
+    return columnas_necesarias() if PROYECTAR_COLUMNAS else None
+
+def leer_excel(contenido, filename):
+    """Lee un XLSX desde memoria (bytes) o desde una ruta y añade la columna 'File Name'"""
+    return lectura_excel.leer_excel(contenido, filename, columnas_leidas())
+
+def descartar_archivos_identicos(archivos):
+    """
+    Calcula la huella (sha256) de los archivos subidos ([(bytes o ruta, filename), ...]) y descarta,
+    sin leerlos como Excel, los idénticos a uno ya incorporado o a otro anterior del lote.
+    Devuelve ([(contenido, filename, huella), ...], {filename: mensaje} de los descartados).
+    """
+    conocidas = huellas_archivos()
+    pendientes = []
+    errores = {}
+    for contenido, filename in archivos:
+        huella = huella_archivo(contenido)
+        if huella in conocidas:
+            if conocidas[huella] == filename:
+                errores[filename] = f"El archivo '{filename}' ya existe en el dataframe."
+            else:
+                errores[filename] = f"El archivo '{filename}' es idéntico a '{conocidas[huella]}', que ya está en el dataframe."
+            continue
+        conocidas[huella] = filename
+        pendientes.append((contenido, filename, huella))
+    return pendientes, errores
+
+def mensaje_solape(solape):
+    """Texto de un solape devuelto por descartar_filas_repetidas"""
+    fechas = f" ({solape['desde']:%d/%m/%Y} - {solape['hasta']:%d/%m/%Y})" if solape['desde'] and solape['hasta'] else ""
+    repetidas = "del mismo jugador, fecha y drill" if solape.get('clave') == 'drill' else "idénticas"
+    return f"'{solape['archivo']}' se solapa con '{solape['con']}': {solape['filas']} filas {repetidas}{fechas} no se han añadido."
+
+def leer_excels(archivos, workers=None):
+    """
+    Lee varios XLSX ([(bytes o ruta, filename), ...]) repartiéndolos entre un pool de procesos.
+    Devuelve, en el mismo orden, una lista de (df, None, rendimiento) o (None, mensaje de error, None).
+    Con un solo archivo (o workers=1) se lee en este proceso.
+    """
+    workers = workers or min(len(archivos), os.cpu_count() or 1)
+    columnas = columnas_leidas()
+    if workers <= 1:
+        return [leer_excel_seguro(contenido, filename, columnas) for contenido, filename in archivos]
+    # spawn: polars no es seguro tras un fork con su pool de hilos ya iniciado.
+    # Los procesos solo ejecutan utils/lectura_excel.py: las columnas se calculan aquí.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futuros = [pool.submit(leer_excel_seguro, contenido, filename, columnas) for contenido, filename in archivos]
+        return [futuro.result() for futuro in futuros]
+
+def incorporar_archivo(df_new, filename):
+    """
+    Añade los datos de un archivo como una nueva partición del dataset GPS y actualiza las estadísticas.
+    Devuelve (True, None) si se incorporó o (False, mensaje) si no se pudo.
+    """
+    incorporados, errores, _ = incorporar_archivos([(df_new, filename)])
+    return (True, None) if incorporados else (False, errores[filename])
+
+@escritura_exclusiva()
+def incorporar_archivos(archivos, progreso=None, huellas=None):
+    """
+    Añade un lote de archivos ([(df, filename), ...]) al dataset GPS en una sola versión
+    y actualiza las estadísticas una sola vez con todas las filas nuevas.
+    Los archivos que ya existen (mismo nombre o, con huellas {filename: huella_archivo}, mismo
+    contenido, en el dataset o repetidos en el lote) se descartan, y de los demás solo se
+    añaden las filas que no estaban ya (ver descartar_filas_repetidas).
+    Si se indica, progreso(etapa) se llama al empezar cada etapa (ver utils/trabajos.py).
+    Devuelve (lista de archivos incorporados, {archivo: mensaje} de los descartados,
+    lista de avisos de solapes con otros archivos).
+    Solo se escriben las particiones nuevas y el manifest; el resto del dataset no se toca.
+    La comprobación de duplicados, la escritura y las estadísticas se hacen con el bloqueo de
+    escritura tomado, así que dos subidas simultáneas no se pisan.
+    """
+    errores = {}
+    validos = []
+    huellas = huellas or {}
+    # Verificar si los archivos ya existen en el dataset (solo se lee el manifest)
+    existentes = set(archivos_dataset())
+    conocidas = huellas_archivos()
+    for df_new, filename in archivos:
+        if filename in existentes:
+            errores[filename] = f"El archivo '{filename}' ya existe en el dataframe."
+            continue
+        huella = huellas.get(filename)
+        if huella in conocidas:
+            errores[filename] = f"El archivo '{filename}' es idéntico a '{conocidas[huella]}', que ya está en el dataframe."
+            continue
+        existentes.add(filename)
+        if huella is not None:
+            conocidas[huella] = filename
+        validos.append((df_new, filename))
+
+    # Quitar las filas que ya están en el dataset (exports con fechas solapadas)
+    if progreso is not None:
+        progreso("Comprobación de filas repetidas")
+    validos, solapes = descartar_filas_repetidas(validos)
+    avisos = [mensaje_solape(solape) for solape in solapes]
+    for aviso in avisos:
+        print(aviso)
+    for df_new, filename in validos:
+        if df_new.height == 0:
+            errores[filename] = f"Todas las filas de '{filename}' ya están en el dataframe."
+    validos = [(df_new, filename) for df_new, filename in validos if df_new.height > 0]
+    if not validos:
+        return [], errores, avisos
+
+    if progreso is not None:
+        progreso("Escritura del dataset")
+    try:
+        agregar_particiones(validos, huellas)
+    except Exception as e:
+        errores.update({filename: f"Error al procesar el archivo: {str(e)}" for _, filename in validos})
+        return [], errores, avisos
+
+    # Actualiza solo las estadísticas de los grupos que contienen los archivos nuevos
+    if progreso is not None:
+        progreso("Estadísticas")
+    try:
+        # Con el esquema canónico (ya aplicado al quitar las filas repetidas) los archivos del lote se concatenan sin conflictos de tipos
+        df_cambios = pl.concat([df_new for df_new, _ in validos], how='diagonal_relaxed')
+        resultado = actualizar_estadisticas(df_cambios)
+        if resultado is not None and len(resultado) > 0 and resultado[0] is not None:
+            print("Estadísticas calculadas correctamente después de añadir archivo.")
+        else:
+            print("No hay suficientes datos para calcular estadísticas.")
+    except Exception as e:
+        print(f"Error al calcular estadísticas: {str(e)}")
+
+    return [filename for _, filename in validos], errores, avisos
@@ -0,0 +1,52 @@
+import polars as pl
+import io
+import os
+import time
+
+
+# ============================================================================
+# LECTURA DE LOS EXCEL
+# ============================================================================
+# Lectura de los exports del proveedor, separada de utils/ingesta.py para que los procesos del
+# pool de leer_excels solo importen polars: este módulo no importa la aplicación, el dataset ni
+# las estadísticas. (Con spawn, cada proceso vuelve a importar además el script principal;
+# app.py no construye la aplicación cuando se importa así, ver su final.)
+
+# Motor de lectura de los Excel: calamine (paquete fastexcel), que lee la hoja en Rust y
+# permite descartar columnas durante la lectura
+MOTOR_EXCEL = 'calamine'
+
+# Hoja del export del proveedor con los datos (la primera)
+HOJA_EXCEL = 1
+
+def leer_excel(contenido, filename, columnas=None):
+    """
+    Lee un XLSX desde memoria (bytes) o desde una ruta y añade la columna 'File Name'.
+    Con columnas (un conjunto de nombres) solo se leen esas; las que falten en el export se ignoran.
+    """
+    opciones = {}
+    if columnas is not None:
+        opciones['use_columns'] = lambda columna: columna.name in columnas
+    df_new = pl.read_excel(io.BytesIO(contenido) if isinstance(contenido, bytes) else contenido,
+                           sheet_id=HOJA_EXCEL, engine=MOTOR_EXCEL, read_options=opciones)
+    return df_new.with_columns(pl.lit(filename).alias('File Name'))
+
+def rendimiento_lectura(filas, tamano, segundos):
+    """Texto con el rendimiento de la lectura de un archivo: filas, filas/s y MB/s"""
+    segundos = max(segundos, 1e-9)
+    return f"{filas} filas en {segundos:.2f} s ({filas / segundos:,.0f} filas/s, {tamano / 1024 / 1024 / segundos:.1f} MB/s)"
+
+def leer_excel_seguro(contenido, filename, columnas=None):
+    """
+    leer_excel que devuelve (df, None, rendimiento) o (None, mensaje, None) en vez de lanzar
+    la excepción (para el pool). El rendimiento es el texto de rendimiento_lectura.
+    """
+    try:
+        tamano = len(contenido) if isinstance(contenido, bytes) else os.path.getsize(contenido)
+        inicio = time.perf_counter()
+        df_new = leer_excel(contenido, filename, columnas)
+        rendimiento = rendimiento_lectura(df_new.height, tamano, time.perf_counter() - inicio)
+        print(f"Leído '{filename}': {rendimiento}")
+        return df_new, None, rendimiento
+    except Exception as e:
+        return None, f"Error al procesar el archivo '{filename}': {str(e)}", None
@@ -0,0 +1,106 @@
+"""
+Reconstrucción completa de las estadísticas de la temporada.
+
+Se usa cuando cambia Columnas_interés.txt, se cargan muchas semanas de golpe o se
+vuelve a una versión anterior del dataset: recalcula todas las particiones por
+Week Team repartiendo las semanas entre varios procesos, y las publica de forma
+atómica al terminar.
+
+Uso:
+    python -m utils.reconstruir [--workers N]
+    python -m utils.reconstruir --versiones            (versiones conservadas del dataset)
+    python -m utils.reconstruir --restaurar VERSION    (volver a una versión y recalcular)
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils.datos import existe_dataset, scan_gps, versiones_dataset, restaurar_version, escritura_exclusiva
+from utils.utils import (calcular_estadisticas, cargar_columnas_interes, materializar_semanas,
+                         nuevo_directorio_semanas, publicar_directorio_semanas)
+
+
+def _limitar_hilos(hilos):
+    """Inicializador de cada proceso del pool: limita los hilos de polars de ese proceso"""
+    # polars crea su pool de hilos en el primer cálculo, así que basta con fijarlo antes
+    os.environ['POLARS_MAX_THREADS'] = str(hilos)
+
+def _reconstruir_semana(week_team, columnas_interes, raiz):
+    """Materializa un Week Team en la carpeta raiz y devuelve el tiempo empleado"""
+    inicio = time.perf_counter()
+    materializar_semanas([week_team], columnas_interes, raiz=raiz)
+    return week_team, time.perf_counter() - inicio
+
+@escritura_exclusiva()
+def reconstruir_estadisticas(workers=None):
+    """
+    Recalcula las estadísticas de temporada y todas las particiones por Week Team.
+    Las semanas se reparten entre un pool de procesos y se escriben en una carpeta nueva
+    que se publica (ver publicar_directorio_semanas) solo cuando todas han terminado.
+    Mientras dura se mantiene el bloqueo de escritura (los procesos del pool no lo toman).
+    Devuelve un diccionario Week Team -> segundos.
+    """
+    if not existe_dataset():
+        print("df_gps.parquet does not exist or is empty")
+        return None
+
+    columnas_interes = cargar_columnas_interes()
+    week_teams = scan_gps(['Week Team']).unique().collect()['Week Team'].drop_nulls().to_list()
+    workers = workers or min(len(week_teams), os.cpu_count() or 1) or 1
+
+    # Repartir los hilos de polars entre los procesos del pool para no sobresuscribir la CPU
+    hilos = max(1, (os.cpu_count() or 1) // workers)
+
+    raiz_nueva = nuevo_directorio_semanas()
+    inicio = time.perf_counter()
+    tiempos = {}
+    try:
+        # spawn: polars no es seguro tras un fork con su pool de hilos ya iniciado
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_limitar_hilos, initargs=(hilos,)) as pool:
+            futuros = [pool.submit(_reconstruir_semana, week_team, columnas_interes, raiz_nueva)
+                       for week_team in week_teams]
+
+            # Mientras tanto, las estadísticas de temporada se calculan en este proceso.
+            # calcular_estadisticas no lanza sus errores: devuelve None y no se publica nada
+            if calcular_estadisticas(columnas_interes=columnas_interes, materializar=False)[0] is None:
+                for futuro in futuros:
+                    futuro.cancel()
+                raise RuntimeError("No se pudieron calcular las estadísticas de temporada")
+
+            for futuro in as_completed(futuros):
+                week_team, segundos = futuro.result()
+                tiempos[week_team] = segundos
+                print(f"Week Team {week_team}: {segundos:.2f} s")
+    except BaseException:
+        shutil.rmtree(raiz_nueva, ignore_errors=True)
+        raise
+
+    # Publicar todas las particiones a la vez cambiando el puntero a la carpeta nueva
+    publicar_directorio_semanas(raiz_nueva)
+
+    print(f"Reconstrucción completa: {len(tiempos)} semanas en {time.perf_counter() - inicio:.2f} s con {workers} procesos")
+    return tiempos
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Reconstruye todas las estadísticas de la temporada")
+    parser.add_argument('--workers', type=int, default=None, help="Número de procesos (por defecto, uno por CPU)")
+    parser.add_argument('--versiones', action='store_true', help="Mostrar las versiones conservadas del dataset")
+    parser.add_argument('--restaurar', type=int, default=None, metavar='VERSION',
+                        help="Volver a una versión conservada del dataset antes de recalcular")
+    args = parser.parse_args()
+
+    if args.versiones:
+        for version in versiones_dataset():
+            print(f"v{version['version']:<5} {version['fecha']}  {version['filas']:>9} filas  {', '.join(version['archivos'])}")
+    else:
+        if args.restaurar is not None:
+            nueva = restaurar_version(args.restaurar)
+            if nueva is None:
+                raise SystemExit(1)
+            print(f"Versión {args.restaurar} restaurada como versión {nueva}")
+        reconstruir_estadisticas(args.workers)
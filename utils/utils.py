@@ -1,322 +1,619 @@
 import polars as pl
 import numpy as np
 from datetime import datetime
+import json
 import os
+import shutil
+import tempfile
+from urllib.parse import quote
 
+from utils.cache import obtener_o_calcular
+from utils.sketches import (construir_sketch, fusionar_sketch, estadisticas_desde_sketch, guardar_sketches, leer_sketches,
+                             borrar_sketches)
+from utils.datos import (DATA_PATH, DATA_GPS_PATH, existe_dataset, version_dataset, columnas_dataset,
+                         scan_gps, scan_sesiones, filtrar_datos_gps, resumen_sesion,
+                         escritura_exclusiva, escribir_parquet_atomico)
 
-# Obtener la ruta base del proyecto basada en la ubicación de este archivo
-BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_GPS_PATH = os.path.join(BASE_PATH, 'data', 'gps')
-DATA_PROCESSED_PATH = os.path.join(BASE_PATH, 'data', 'processed')
+
+DATA_PROCESSED_PATH = os.path.join(DATA_PATH, 'processed')
+DATA_SEMANAS_PATH = os.path.join(DATA_PROCESSED_PATH, 'semanas')
 
 
 # Asegurar que la carpeta de datos procesados existe
 def ensure_dir(directory):
     if not os.path.exists(directory):
         os.makedirs(directory)
-        
-def calcular_estadisticas(fecha=None, columnas_interes=None, estadistica=None):
+
+# ============================================================================
+# REGISTRO DE ESTADÍSTICAS
+# ============================================================================
+# Cada estadística se declara una sola vez con su etiqueta y una función que, dada
+# una columna, devuelve la expresión de agregación de polars. Todas las registradas
+# se evalúan en la misma agregación (calcular_grupos), así que añadir una nueva no
+# supone otra lectura de los datos. El selector de la Session Report se construye
+# a partir de este registro.
+#
+# 'resumen' (opcional) calcula la misma estadística desde un sketch fusionable
+# (ver utils/sketches.py): recibe cuantil(q, interpolacion) y devuelve una expresión
+# sobre n, suma, suma2, minimo y maximo.
+REGISTRO_ESTADISTICAS = {}
+
+# Actualizar las estadísticas al subir archivos fusionando sketches en lugar de recalcular los grupos
+USAR_SKETCHES_CUANTILES = False
+
+def registrar_estadistica(nombre, etiqueta, expresion, resumen=None):
+    """Registra una estadística: nombre (valor guardado en 'Estadistica'), etiqueta para la interfaz y expresión"""
+    REGISTRO_ESTADISTICAS[nombre] = {'etiqueta': etiqueta, 'expresion': expresion, 'resumen': resumen}
+
+def _coeficiente_variacion(columna):
+    """Desviación típica entre la media, en porcentaje (nulo si la media es 0)"""
+    media = pl.col(columna).mean()
+    return pl.when(media != 0).then(pl.col(columna).std() / media.abs() * 100)
+
+def _desviacion_resumen(cuantil):
+    """Desviación típica muestral a partir de n, suma y suma de cuadrados"""
+    n = pl.col('n')
+    varianza = (pl.col('suma2') - pl.col('suma') ** 2 / n) / (n - 1)
+    return pl.when(n > 1).then(pl.max_horizontal(varianza, pl.lit(0.0)).sqrt())
+
+def _coeficiente_variacion_resumen(cuantil):
+    media = pl.col('suma') / pl.col('n')
+    return pl.when(media != 0).then(_desviacion_resumen(cuantil) / media.abs() * 100)
+
+registrar_estadistica("mean", "Media", lambda columna: pl.col(columna).mean(),
+                      lambda cuantil: pl.col('suma') / pl.col('n'))
+registrar_estadistica("median", "Mediana", lambda columna: pl.col(columna).median(),
+                      lambda cuantil: cuantil(0.5, 'linear'))
+registrar_estadistica("max", "Máximo", lambda columna: pl.col(columna).max(),
+                      lambda cuantil: pl.col('maximo'))
+registrar_estadistica("min", "Mínimo", lambda columna: pl.col(columna).min(),
+                      lambda cuantil: pl.col('minimo'))
+registrar_estadistica("p75", "Percentil 75", lambda columna: pl.col(columna).quantile(0.75),
+                      lambda cuantil: cuantil(0.75))
+registrar_estadistica("p90", "Percentil 90", lambda columna: pl.col(columna).quantile(0.90),
+                      lambda cuantil: cuantil(0.90))
+registrar_estadistica("p95", "Percentil 95", lambda columna: pl.col(columna).quantile(0.95),
+                      lambda cuantil: cuantil(0.95))
+registrar_estadistica("std", "Desviación típica", lambda columna: pl.col(columna).std(),
+                      _desviacion_resumen)
+registrar_estadistica("cv", "Coeficiente de variación (%)", _coeficiente_variacion,
+                      _coeficiente_variacion_resumen)
+registrar_estadistica("iqr", "Rango intercuartílico",
+                      lambda columna: pl.col(columna).quantile(0.75) - pl.col(columna).quantile(0.25),
+                      lambda cuantil: cuantil(0.75) - cuantil(0.25))
+registrar_estadistica("sum", "Suma", lambda columna: pl.col(columna).sum(),
+                      lambda cuantil: pl.col('suma'))
+
+# Estadísticas calculadas por defecto para cada grupo (todas las registradas, en orden de registro)
+ESTADISTICAS = list(REGISTRO_ESTADISTICAS)
+
+def opciones_estadisticas():
+    """Opciones del selector de estadística (label/value) a partir del registro"""
+    return [{'label': info['etiqueta'], 'value': nombre} for nombre, info in REGISTRO_ESTADISTICAS.items()]
+
+def etiqueta_estadistica(nombre):
+    """Etiqueta legible de una estadística registrada (o el propio nombre si no lo está)"""
+    return REGISTRO_ESTADISTICAS.get(nombre, {}).get('etiqueta', nombre)
+
+# Ficheros de estadísticas generales por nivel (clave del nivel -> nombre del parquet)
+FICHEROS_ESTADISTICAS = {
+    'Player': 'df_jugadores_estadisticas.parquet',
+    'Position': 'df_position_estadisticas.parquet',
+    'Team': 'df_team_estadisticas.parquet',
+}
+
+def cargar_columnas_interes():
+    """Carga la lista de columnas de interés desde Columnas_interés.txt"""
+    path_to_txt = os.path.join(DATA_GPS_PATH, 'Columnas_interés.txt')
+    with open(path_to_txt, 'r') as f:
+        return [line.strip() for line in f.readlines()]
+
+# Columnas que necesita el cálculo de estadísticas además de las columnas de interés
+COLUMNAS_CLAVE = ['Player', 'Position', 'Team ', 'Match Day', 'Selection', 'Week Team']
+
+@escritura_exclusiva()
+def guardar_estadisticas(df_estadisticas, df_estadisticas_position, df_estadisticas_team):
+    """
+    Escribe las estadísticas generales en data/processed con la nomenclatura estándar.
+    Cada archivo se publica de forma atómica: la Session Report nunca lee uno a medio escribir.
+    """
+    for fichero, df in zip(FICHEROS_ESTADISTICAS.values(), [df_estadisticas, df_estadisticas_position, df_estadisticas_team]):
+        escribir_parquet_atomico(df, os.path.join(DATA_PROCESSED_PATH, fichero))
+
+@escritura_exclusiva()
+def borrar_estadisticas():
+    """
+    Elimina todas las estadísticas guardadas: las generales, las particiones por Week Team
+    (todas las carpetas y el puntero) y los sketches. Se usa cuando el dataset queda vacío,
+    para que la siguiente subida no fusione sus estadísticas con las de datos ya eliminados.
+    """
+    for fichero in FICHEROS_ESTADISTICAS.values():
+        ruta = os.path.join(DATA_PROCESSED_PATH, fichero)
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+    if os.path.exists(ruta_puntero_semanas()):
+        os.remove(ruta_puntero_semanas())
+    for carpeta in carpetas_semanas():
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+    borrar_sketches()
+
+def calcular_estadisticas(fecha=None, columnas_interes=None, estadistica=None, materializar=True):
     """
     Calculates comparative statistics for each player, position and team by Match Day.
     If fecha is provided, filters data for that specific date's Week Team.
+    With materializar=False the per-week partitions are not rewritten (see utils/reconstruir.py).
     """
     # Asegurar que el directorio de datos procesados existe
     ensure_dir(DATA_PROCESSED_PATH)
     
-    # Verificar que el archivo parquet existe y cargarlo
-    path_to_parquet = os.path.join(DATA_GPS_PATH, 'df_gps.parquet')
-    if not os.path.exists(path_to_parquet) or os.path.getsize(path_to_parquet) == 0:
+    # Verificar que el dataset existe
+    if not existe_dataset():
         print("df_gps.parquet does not exist or is empty")
         return None, None, None
-        
+
+    # Las consultas por fecha se resuelven desde la caché de estadísticas por semana.
+    # Sus errores de lectura no se ocultan: llegan al callback de la página que las pidió.
+    if fecha is not None:
+        return calcular_estadisticas_fecha(fecha, columnas_interes, estadistica)
+
     try:
-        df = pl.read_parquet(path_to_parquet)
-        df = df.filter(pl.col('Match Day') != 'Rehab')
+        # Cargar columnas de interés
+        if columnas_interes is None:
+            columnas_interes = cargar_columnas_interes()
+
+        # Leer solo las columnas necesarias, con los filtros aplicados durante la lectura
+        version = version_dataset()
+        df = scan_sesiones(columnas=COLUMNAS_CLAVE + columnas_interes).collect()
         
         if df.height == 0:
             print("DataFrame is empty")
             return None, None, None
-        
-        # # Crear backup
-        # backup_path = os.path.join(DATA_GPS_PATH, 'df_gps_backup.parquet')
-        # df.write_parquet(backup_path)
-        
-        # Filtrar por fecha si se proporciona
-        if fecha is not None:
-            if 'Date' not in df.columns or 'Week Team' not in df.columns:
-                print("Required date columns missing")
-                return None, None, None
-                
-            # Obtener los datos de fecha específica para encontrar el Match Day correspondiente
-            df_fecha = df.filter(pl.col('Date') == fecha)
-            if df_fecha.height == 0:
-                print(f"No data found for date {fecha}")
-                return None, None, None
-                
-            # Obtener el Match Day y Week Team para la fecha especificada
-            match_day_especifico = df_fecha['Match Day'][0]
-            week_team = df_fecha['Week Team'][0]
-            
-            # Filtrar por Week Team para incluir MD en cálculos de porcentaje
-            df = df.filter(pl.col('Week Team') == week_team)
-            #print(f"Filtered data for Week Team: {week_team}, target Match Day: {match_day_especifico}")
-            
-        # Cargar columnas de interés
-        if columnas_interes is None:
-            path_to_txt = os.path.join(DATA_GPS_PATH, 'Columnas_interés.txt')
-            with open(path_to_txt, 'r') as f:
-                columnas_interes = [line.strip() for line in f.readlines()]
-
-        # Aplicar filtros
-        df = (df.filter(pl.col('Match Day') != 'Rehab')
-              .filter(pl.col('Player') != 'TEAM')
-              .filter(pl.col('Team ') != 'TEAM')
-              .filter(pl.col('Selection') == 'Drills')
-              .with_columns(
-                  pl.when(pl.col('Team ').str.contains('Sporting'))
-                  .then(pl.lit('Sporting de Gijón'))
-                  .otherwise(pl.col('Team '))
-                  .alias('Team ')
-              ))
-
-        # Obtener valores únicos
-        match_days = df['Match Day'].unique().to_list()
-        jugadores = df['Player'].unique().to_list()
-        posiciones = df['Position'].unique().to_list() 
-        equipos = df['Team '].unique().to_list()
 
         # Estadísticas a calcular
         if estadistica is not None:
             estadisticas = [estadistica]  # Solo calcular la estadística seleccionada
         else:
-            estadisticas = ["mean", "median", "max", "min", "p75", "p90", "p95"]  # Calcular todas las estadísticas
-        
-        # Inicializar listas de resultados
-        resultados_jugadores = []
-        resultados_position = []
-        resultados_team = []
-
-        # Calcular estadísticas para cada grupo
-        for jugador in jugadores:
-            df_jugador = df.filter(pl.col('Player') == jugador)
-            posicion_jugador = df_jugador['Position'][0] if df_jugador.height > 0 else "Desconocida"
-            
-            for match_day in match_days:
-                df_match = df_jugador.filter(pl.col('Match Day') == match_day)
-                if df_match.height == 0:
-                    continue
-                    
-                for estadistica in estadisticas:
-                    registro = {
-                        "Player": jugador,
-                        "Position": posicion_jugador,
-                        "Match Day": match_day,
-                        "Estadistica": estadistica
-                    }
-                    registro.update(calcular_metricas(df_match, columnas_interes, estadistica))
-                    resultados_jugadores.append(registro)
-
-        for posicion in posiciones:
-            df_posicion = df.filter(pl.col('Position') == posicion)
-            for match_day in match_days:
-                df_match = df_posicion.filter(pl.col('Match Day') == match_day)
-                if df_match.height == 0:
-                    continue
-                    
-                for estadistica in estadisticas:
-                    registro = {
-                        "Position": posicion,
-                        "Match Day": match_day,
-                        "Estadistica": estadistica
-                    }
-                    registro.update(calcular_metricas(df_match, columnas_interes, estadistica))
-                    resultados_position.append(registro)
-
-        for equipo in equipos:
-            df_equipo = df.filter(pl.col('Team ') == equipo)
-            for match_day in match_days:
-                df_match = df_equipo.filter(pl.col('Match Day') == match_day)
-                if df_match.height == 0:
-                    continue
-                    
-                for estadistica in estadisticas:
-                    registro = {
-                        "Team": equipo,
-                        "Match Day": match_day,
-                        "Estadistica": estadistica
-                    }
-                    registro.update(calcular_metricas(df_match, columnas_interes, estadistica))
-                    resultados_team.append(registro)
-
-        # Crear DataFrames
-        df_estadisticas = pl.DataFrame(resultados_jugadores)
-        df_estadisticas_position = pl.DataFrame(resultados_position)
-        df_estadisticas_team = pl.DataFrame(resultados_team)
+            estadisticas = ESTADISTICAS  # Calcular todas las estadísticas
+
+        # Solo las columnas de interés presentes en los datos
+        columnas = [col for col in columnas_interes if col in df.columns]
+
+        # Una sola pasada group_by().agg() por nivel; collect_all ejecuta los tres planes en paralelo
+        planes = planes_estadisticas(df.lazy(), columnas, estadisticas)
+        if estadistica is None and USAR_SKETCHES_CUANTILES:
+            # Los sketches se reconstruyen desde los mismos datos en memoria (sin error acumulado)
+            planes += planes_sketches(df.lazy(), columnas)
+        resultados = pl.collect_all(planes)
+        df_estadisticas, df_estadisticas_position, df_estadisticas_team = resultados[:3]
+        if len(resultados) > 3:
+            guardar_sketches(dict(zip(FICHEROS_ESTADISTICAS, zip(resultados[3::2], resultados[4::2]))), version)
 
         # Calcular diferencias porcentuales
         df_estadisticas = calcular_diferencia_porcentual(df_estadisticas)
         df_estadisticas_position = calcular_diferencia_porcentual(df_estadisticas_position)
         df_estadisticas_team = calcular_diferencia_porcentual(df_estadisticas_team)
 
-        # Guardar resultados o filtrar por Match Day específico si se proporcionó fecha
-        if fecha is not None:
-            # Filtrar resultados para devolver solo los datos del Match Day específico
-            df_estadisticas_filtrado = df_estadisticas.filter(pl.col('Match Day') == match_day_especifico)
-            df_estadisticas_position_filtrado = df_estadisticas_position.filter(pl.col('Match Day') == match_day_especifico)
-            df_estadisticas_team_filtrado = df_estadisticas_team.filter(pl.col('Match Day') == match_day_especifico)
-            
-            #print(f"Returning statistics for specific Match Day: {match_day_especifico}")
-            return df_estadisticas_filtrado, df_estadisticas_position_filtrado, df_estadisticas_team_filtrado
-        
-        else:
-            # Nomenclatura original para estadísticas generales
-            output_path = os.path.join(DATA_PROCESSED_PATH, 'df_jugadores_estadisticas.parquet')
-            output_path_position = os.path.join(DATA_PROCESSED_PATH, 'df_position_estadisticas.parquet')
-            output_path_team = os.path.join(DATA_PROCESSED_PATH, 'df_team_estadisticas.parquet')
-
-            df_estadisticas.write_parquet(output_path)
-            df_estadisticas_position.write_parquet(output_path_position)
-            df_estadisticas_team.write_parquet(output_path_team)
-            
-            print("Estadísticas generales guardadas con nomenclatura estándar")
-            return df_estadisticas, df_estadisticas_position, df_estadisticas_team
+        guardar_estadisticas(df_estadisticas, df_estadisticas_position, df_estadisticas_team)
+        print("Estadísticas generales guardadas con nomenclatura estándar")
+
+        # Materializar también las estadísticas por semana que consulta el Session Report
+        if estadistica is None and materializar:
+            materializar_semanas(columnas_interes=columnas_interes)
+        return df_estadisticas, df_estadisticas_position, df_estadisticas_team
 
     except Exception as e:
         print(f"Error calculating statistics: {str(e)}")
         return None, None, None
 
-def calcular_metricas(df, columnas, estadistica):
-    """Función auxiliar para calcular estadísticas para columnas dadas"""
-    resultado = {}
-    for columna in columnas:
-        if columna not in df.columns:
+def calcular_estadisticas_fecha(fecha, columnas_interes=None, estadistica=None):
+    """
+    Devuelve las estadísticas del Match Day de la fecha indicada, calculadas sobre su Week Team.
+    El resultado de cada (versión del dataset, Week Team, estadística, columnas) se guarda en una
+    caché LRU, así que las distintas vistas de una misma sesión solo lo calculan una vez.
+    """
+    columnas_gps = columnas_dataset()
+    if 'Date' not in columnas_gps or 'Week Team' not in columnas_gps:
+        print("Required date columns missing")
+        return None, None, None
+
+    # Obtener el Match Day y Week Team para la fecha especificada (del índice de sesiones, sin leer los datos)
+    sesion = resumen_sesion(fecha)
+    if sesion is None or sesion['match_day'] is None:
+        print(f"No data found for date {fecha}")
+        return None, None, None
+    match_day_especifico = sesion['match_day']
+    week_team = sesion['week_team']
+
+    if columnas_interes is None:
+        columnas_interes = cargar_columnas_interes()
+    columnas = [col for col in columnas_interes if col in columnas_gps]
+    estadisticas = [estadistica] if estadistica is not None else ESTADISTICAS
+
+    def leer_semana():
+        # Las estadísticas de la semana ya están materializadas; si falta la partición se genera una vez,
+        # con el bloqueo de escritura tomado (otro lector puede haberla generado mientras se esperaba)
+        semana = leer_estadisticas_semana(week_team, columnas, estadisticas)
+        if semana is None:
+            with escritura_exclusiva():
+                semana = leer_estadisticas_semana(week_team, columnas, estadisticas)
+                if semana is None:
+                    materializar_semanas([week_team])
+                    semana = leer_estadisticas_semana(week_team, columnas, estadisticas)
+        return semana
+
+    clave = (version_dataset(), version_semana(week_team), week_team, tuple(estadisticas), tuple(columnas))
+    semana = obtener_o_calcular(clave, leer_semana)
+    if semana is None:
+        return None, None, None
+
+    # Devolver solo los datos del Match Day específico
+    return tuple(df.filter(pl.col('Match Day') == match_day_especifico) for df in semana)
+
+# Las particiones por Week Team viven en una carpeta versionada (data/processed/semanas-<id>/)
+# y data/processed/semanas.json indica cuál es la actual. Una reconstrucción escribe una carpeta
+# nueva y la publica sustituyendo el puntero con os.replace, así que los lectores ven siempre
+# una carpeta completa. Sin puntero (instalaciones anteriores) se usa data/processed/semanas/.
+
+def ruta_puntero_semanas():
+    """Ruta del JSON que indica la carpeta actual de particiones por Week Team"""
+    return DATA_SEMANAS_PATH + '.json'
+
+def directorio_semanas():
+    """Carpeta actual de las particiones por Week Team"""
+    try:
+        with open(ruta_puntero_semanas()) as f:
+            nombre = json.load(f)['directorio']
+    except (OSError, ValueError, KeyError):
+        return DATA_SEMANAS_PATH
+    return os.path.join(os.path.dirname(DATA_SEMANAS_PATH), nombre)
+
+def carpetas_semanas():
+    """Todas las carpetas de particiones por Week Team (la actual, la anterior y las que queden a medias)"""
+    raiz = os.path.dirname(DATA_SEMANAS_PATH)
+    prefijo = os.path.basename(DATA_SEMANAS_PATH)
+    if not os.path.isdir(raiz):
+        return []
+    return [os.path.join(raiz, nombre) for nombre in os.listdir(raiz)
+            if nombre == prefijo or nombre.startswith(prefijo + '-')]
+
+def nuevo_directorio_semanas():
+    """Crea una carpeta vacía para una versión nueva de las particiones (aún sin publicar)"""
+    ensure_dir(os.path.dirname(DATA_SEMANAS_PATH))
+    return tempfile.mkdtemp(dir=os.path.dirname(DATA_SEMANAS_PATH),
+                            prefix=os.path.basename(DATA_SEMANAS_PATH) + '-' + datetime.now().strftime('%Y%m%d%H%M%S') + '-')
+
+def publicar_directorio_semanas(directorio):
+    """
+    Hace de directorio la carpeta actual de particiones sustituyendo el puntero de forma atómica.
+    Se conserva la carpeta anterior (puede haber lectores usándola) y se borran las demás.
+    Se llama con el bloqueo de escritura tomado.
+    """
+    anterior = directorio_semanas()
+    puntero = ruta_puntero_semanas()
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(puntero), prefix=os.path.basename(puntero) + '.', suffix='.tmp')
+    with os.fdopen(descriptor, 'w') as f:
+        json.dump({'directorio': os.path.basename(directorio)}, f)
+    os.replace(temporal, puntero)
+
+    for carpeta in carpetas_semanas():
+        if os.path.basename(carpeta) not in {os.path.basename(directorio), os.path.basename(anterior)}:
+            shutil.rmtree(carpeta, ignore_errors=True)
+
+def ruta_semana(week_team, raiz=None):
+    """Carpeta de la partición de estadísticas de un Week Team dentro de la carpeta actual de semanas (o de raiz)"""
+    return os.path.join(raiz or directorio_semanas(), f"week_team={quote(str(week_team), safe='')}")
+
+def version_semana(week_team):
+    """Versión (mtime) de la partición de estadísticas de un Week Team, o None si no existe"""
+    try:
+        return os.stat(os.path.join(ruta_semana(week_team), FICHEROS_ESTADISTICAS['Team'])).st_mtime_ns
+    except OSError:
+        return None
+
+def leer_estadisticas_semana(week_team, columnas, estadisticas):
+    """
+    Lee las estadísticas materializadas de un Week Team y devuelve solo las estadísticas y columnas pedidas.
+    Devuelve None si la partición no existe o no contiene lo pedido.
+    """
+    ruta = ruta_semana(week_team)
+    resultados = []
+    for clave, fichero in FICHEROS_ESTADISTICAS.items():
+        path = os.path.join(ruta, fichero)
+        if not os.path.exists(path):
+            return None
+        df = pl.read_parquet(path)
+        if not all(col in df.columns and f"{col} diff" in df.columns for col in columnas):
+            return None
+        if df.height > 0 and not set(estadisticas) <= set(df['Estadistica'].unique().to_list()):
+            return None
+        claves = ['Player', 'Position'] if clave == 'Player' else [clave]
+        resultados.append(
+            df.filter(pl.col('Estadistica').is_in(estadisticas))
+              .select(claves + ['Match Day', 'Estadistica'] + columnas + [f"{col} diff" for col in columnas])
+        )
+    return tuple(resultados)
+
+def materializar_semanas(week_teams=None, columnas_interes=None, raiz=None):
+    """
+    Calcula estadísticas y diferencias de cada Week Team (todas las estadísticas, en una sola pasada)
+    y las guarda particionadas en la carpeta actual de semanas (week_team=<Week Team>/).
+    Si no se indican week_teams se materializan todas las semanas del dataset.
+    Se llama con el bloqueo de escritura tomado (o sobre una raiz que solo usa quien la escribe).
+    raiz permite escribir las particiones en otra carpeta (p. ej. una temporal durante una reconstrucción).
+    """
+    if not existe_dataset():
+        return
+
+    if columnas_interes is None:
+        columnas_interes = cargar_columnas_interes()
+
+    lf = scan_gps(COLUMNAS_CLAVE + columnas_interes).filter(pl.col('Match Day') != 'Rehab')
+    if week_teams is not None:
+        lf = lf.filter(pl.col('Week Team').is_in(list(week_teams)))
+    columnas = [col for col in columnas_interes if col in lf.collect_schema().names()]
+
+    # Semanas con datos (aunque tras los filtros no queden Drills) y estadísticas de todas ellas a la vez
+    semanas_con_datos = lf.select(pl.col('Week Team').unique()).collect()['Week Team'].to_list()
+    resultados = pl.collect_all(
+        planes_estadisticas(filtrar_datos_gps(lf), columnas, ESTADISTICAS, claves_extra=['Week Team'])
+    )
+    resultados = [calcular_diferencia_porcentual(df) for df in resultados]
+
+    for week_team in set(semanas_con_datos) | set(week_teams or []):
+        ruta = ruta_semana(week_team, raiz)
+        if week_team not in semanas_con_datos:
+            # La semana ya no tiene datos: eliminar su partición
+            shutil.rmtree(ruta, ignore_errors=True)
             continue
-            
-        if estadistica == "mean":
-            valor = df[columna].mean()
-        elif estadistica == "median":
-            valor = df[columna].median()
-        elif estadistica == "max":
-            valor = df[columna].max()
-        elif estadistica == "min":
-            valor = df[columna].min()
-        elif estadistica == "p75":
-            valor = df[columna].quantile(0.75)
-        elif estadistica == "p90":
-            valor = df[columna].quantile(0.90)
-        elif estadistica == "p95":
-            valor = df[columna].quantile(0.95)
+
+        for fichero, df in zip(FICHEROS_ESTADISTICAS.values(), resultados):
+            # Escritura atómica: los lectores nunca ven un archivo a medio escribir
+            escribir_parquet_atomico(df.filter(pl.col('Week Team') == week_team).drop('Week Team'),
+                                     os.path.join(ruta, fichero))
+
+def expresion_estadistica(columna, estadistica):
+    """Devuelve la expresión de polars que calcula la estadística indicada sobre una columna (None si no está registrada)"""
+    info = REGISTRO_ESTADISTICAS.get(estadistica)
+    if info is None:
+        return None
+    return info['expresion'](columna)
+
+def calcular_grupos(lf, claves, columnas, estadisticas):
+    """
+    Calcula todas las estadísticas de todas las columnas para cada grupo de claves
+    en una única agregación y devuelve un LazyFrame en formato largo
+    (una fila por grupo y estadística, como en los parquet de estadísticas).
+    """
+    agregaciones = []
+    selecciones = []
+    for orden, estadistica in enumerate(estadisticas):
+        seleccion = ['_grupo'] + claves + [pl.lit(estadistica).alias('Estadistica'), pl.lit(orden).alias('_orden')]
+        for columna in columnas:
+            expresion = expresion_estadistica(columna, estadistica)
+            if expresion is None:
+                continue
+            agregaciones.append(expresion.cast(pl.Float64).alias(f"{estadistica}|{columna}"))
+            seleccion.append(pl.col(f"{estadistica}|{columna}").alias(columna))
+        selecciones.append(seleccion)
+
+    ancho = (lf.group_by(claves, maintain_order=True)
+               .agg(agregaciones)
+               .with_row_index('_grupo'))
+
+    # Pasar de formato ancho (estadística|columna) a una fila por grupo y estadística
+    return (pl.concat([ancho.select(seleccion) for seleccion in selecciones], how='diagonal')
+              .sort(['_grupo', '_orden'])
+              .drop(['_grupo', '_orden']))
+
+def filtrar_grupos(lf, clave, claves_nivel):
+    """Limita lf a los pares (clave, Match Day) de claves_nivel"""
+    # El filtro is_in se empuja hasta la lectura; el semi join deja solo los pares exactos
+    return (lf.filter(pl.col(clave).is_in(claves_nivel[clave].unique().to_list()))
+              .filter(pl.col('Match Day').is_in(claves_nivel['Match Day'].unique().to_list()))
+              .join(claves_nivel.lazy(), on=[clave, 'Match Day'], how='semi'))
+
+def planes_sketches(lf, columnas, grupos=None):
+    """
+    LazyFrames de los sketches (resumen y centroides, alternados) por jugador, posición y equipo.
+    Con grupos se limitan a esos pares (clave, Match Day), como en planes_estadisticas.
+    """
+    lf = lf.rename({'Team ': 'Team'}).with_columns(pl.col(pl.Categorical).cast(pl.String))
+    planes = []
+    for clave in FICHEROS_ESTADISTICAS:
+        lf_nivel = lf if grupos is None else filtrar_grupos(lf, clave, grupos[clave])
+        planes.extend(construir_sketch(lf_nivel, [clave, 'Match Day'], columnas))
+    return planes
+
+def planes_estadisticas(lf, columnas, estadisticas, grupos=None, claves_extra=None):
+    """
+    Construye los LazyFrames de estadísticas por jugador, posición y equipo (sin diferencias).
+    Si se pasan grupos (clave del nivel -> DataFrame con [clave, 'Match Day']),
+    cada nivel se limita a esos grupos. claves_extra (p. ej. ['Week Team']) se añaden
+    delante de las claves de cada nivel para calcular todas las semanas en la misma pasada.
+    """
+    # Las claves se agrupan como texto para que los parquet de estadísticas no dependan de la caché de categorías
+    lf = lf.rename({'Team ': 'Team'}).with_columns(pl.col(pl.Categorical).cast(pl.String))
+    claves_extra = claves_extra or []
+
+    planes = []
+    for clave in FICHEROS_ESTADISTICAS:
+        lf_nivel = lf
+        if grupos is not None:
+            lf_nivel = filtrar_grupos(lf_nivel, clave, grupos[clave])
+        plan = calcular_grupos(lf_nivel, claves_extra + [clave, 'Match Day'], columnas, estadisticas)
+
+        if clave == 'Player':
+            # Posición de cada jugador (la primera registrada en todos sus datos)
+            lf_jugadores = lf
+            if grupos is not None:
+                lf_jugadores = lf.filter(pl.col('Player').is_in(grupos['Player']['Player'].unique().to_list()))
+            posicion_jugador = (lf_jugadores.group_by(claves_extra + ['Player'], maintain_order=True)
+                                            .agg(pl.col('Position').first()))
+            plan = (plan.join(posicion_jugador, on=claves_extra + ['Player'], how='left', maintain_order='left')
+                        .select(claves_extra + ['Player', 'Position', 'Match Day', 'Estadistica'] + columnas))
+        planes.append(plan)
+
+    return planes
+
+@escritura_exclusiva()
+def actualizar_estadisticas(df_cambios, columnas_interes=None, eliminado=False, sketches=None):
+    """
+    Mantiene de forma incremental los parquet de data/processed tras subir o eliminar un archivo.
+    Solo recalcula los grupos (Player/Position/Team, Match Day) presentes en df_cambios
+    (filas añadidas o eliminadas) y los fusiona con las estadísticas existentes.
+    Si no hay estadísticas previas compatibles, recalcula todo con calcular_estadisticas().
+
+    Con sketches (por defecto USAR_SKETCHES_CUANTILES) las filas añadidas se fusionan con los
+    sketches guardados sin leer el dataset; las estadísticas de esos grupos pasan a ser aproximadas
+    (ver las cotas en utils/sketches.py). Las eliminaciones (eliminado=True) recalculan siempre
+    de forma exacta, porque un sketch no permite restar valores.
+
+    Si el dataset ha quedado vacío se eliminan todas las estadísticas guardadas.
+    """
+    if not existe_dataset():
+        print("El dataset ha quedado vacío, eliminando las estadísticas guardadas")
+        borrar_estadisticas()
+        return None, None, None
+
+    try:
+        rutas = [os.path.join(DATA_PROCESSED_PATH, fichero) for fichero in FICHEROS_ESTADISTICAS.values()]
+        if not all(os.path.exists(ruta) for ruta in rutas):
+            return calcular_estadisticas(columnas_interes=columnas_interes)
+        existentes = [pl.read_parquet(ruta) for ruta in rutas]
+
+        if columnas_interes is None:
+            columnas_interes = cargar_columnas_interes()
+        columnas_gps = columnas_dataset()
+        columnas = [col for col in columnas_interes if col in columnas_gps]
+
+        # Si cambiaron las columnas o las estadísticas guardadas, no se puede fusionar
+        for df in existentes:
+            metricas = [col for col in df.columns
+                        if col not in ['Player', 'Position', 'Team', 'Match Day', 'Estadistica'] and not col.endswith(' diff')]
+            if metricas != columnas or set(df['Estadistica'].unique().to_list()) != set(ESTADISTICAS):
+                print("Las estadísticas guardadas no son compatibles, recalculando todo")
+                return calcular_estadisticas(columnas_interes=columnas_interes)
+
+        # Semanas tocadas por las filas añadidas o eliminadas
+        if 'Week Team' in df_cambios.columns:
+            materializar_semanas(df_cambios['Week Team'].unique().to_list(), columnas_interes)
+
+        if sketches is None:
+            sketches = USAR_SKETCHES_CUANTILES
+        guardados = None
+        version = version_dataset()
+        if sketches:
+            # Los sketches deben resumir la versión anterior a este cambio (cada escritura suma uno)
+            version_previa = version - 1 if isinstance(version, int) else None
+            guardados = leer_sketches(FICHEROS_ESTADISTICAS, columnas, version_previa)
+            if guardados is None:
+                print("No hay sketches guardados de la versión anterior del dataset, recalculando todo")
+                return calcular_estadisticas(columnas_interes=columnas_interes)
+
+        # Grupos tocados por las filas añadidas o eliminadas
+        df_cambios = (filtrar_datos_gps(df_cambios).rename({'Team ': 'Team'})
+                                                   .with_columns(pl.col(pl.Categorical).cast(pl.String)))
+        grupos = {clave: df_cambios.select([clave, 'Match Day']).unique() for clave in FICHEROS_ESTADISTICAS}
+
+        if sketches and not eliminado and all(REGISTRO_ESTADISTICAS[e]['resumen'] for e in ESTADISTICAS):
+            nuevos = actualizar_sketches(guardados, df_cambios, columnas, grupos, version)
+            # La posición de los jugadores ya conocidos se mantiene; la de los nuevos sale de sus filas
+            posiciones = (pl.concat([existentes[0].select(['Player', 'Position']),
+                                     df_cambios.select(['Player', 'Position'])], how='vertical_relaxed')
+                            .unique('Player', keep='first', maintain_order=True))
+            nuevos[0] = (nuevos[0].join(posiciones, on='Player', how='left', maintain_order='left')
+                                  .select(['Player', 'Position', 'Match Day', 'Estadistica'] + columnas))
         else:
-            continue
-            
-        resultado[columna] = valor
-    return resultado
+            # Recalcular solo esos grupos leyendo únicamente las columnas necesarias
+            lf = scan_sesiones(columnas=COLUMNAS_CLAVE + columnas)
+            planes = planes_estadisticas(lf, columnas, ESTADISTICAS, grupos)
+            if sketches:
+                planes += planes_sketches(lf, columnas, grupos)
+            nuevos = pl.collect_all(planes)
+            if sketches:
+                # Sustituir de forma exacta los sketches de los grupos recalculados
+                guardar_sketches({
+                    clave: tuple(pl.concat([parte.join(grupos[clave], on=[clave, 'Match Day'], how='anti'), nueva],
+                                           how='vertical_relaxed')
+                                 for parte, nueva in zip(guardados[clave], sketch))
+                    for clave, sketch in zip(FICHEROS_ESTADISTICAS, zip(nuevos[3::2], nuevos[4::2]))
+                }, version)
+            nuevos = nuevos[:3]
+
+        resultados = []
+        for clave, df_existente, df_nuevo in zip(FICHEROS_ESTADISTICAS, existentes, nuevos):
+            # Quitar los grupos recalculados (y las diferencias, que dependen del MD del grupo)
+            df_base = (df_existente
+                       .select([col for col in df_existente.columns if not col.endswith(' diff')])
+                       .join(grupos[clave], on=[clave, 'Match Day'], how='anti'))
+            if clave == 'Player':
+                # La posición del jugador puede cambiar si cambian sus primeros registros
+                df_base = df_base.update(df_nuevo.select(['Player', 'Position']).unique('Player', keep='first'), on='Player')
+            df_fusionado = pl.concat([df_base, df_nuevo], how='diagonal_relaxed')
+            resultados.append(calcular_diferencia_porcentual(df_fusionado))
+
+        guardar_estadisticas(*resultados)
+        print("Estadísticas actualizadas de forma incremental")
+        return tuple(resultados)
+
+    except Exception as e:
+        print(f"Error updating statistics: {str(e)}")
+        return None, None, None
+
+def actualizar_sketches(guardados, df_cambios, columnas, grupos, version):
+    """
+    Fusiona los sketches guardados con los de las filas añadidas (df_cambios, ya filtrado y con 'Team'),
+    los guarda como sketches de la versión indicada del dataset y devuelve las estadísticas de los grupos tocados por nivel (sin diferencias ni posición).
+    """
+    registro = {nombre: REGISTRO_ESTADISTICAS[nombre] for nombre in ESTADISTICAS}
+    fusionados = {}
+    estadisticas = []
+    for clave in FICHEROS_ESTADISTICAS:
+        claves = [clave, 'Match Day']
+        sketch_cambios = construir_sketch(df_cambios.lazy(), claves, columnas)
+        fusionados[clave] = tuple(pl.collect_all(fusionar_sketch(guardados[clave], sketch_cambios, claves)))
+        tocados = tuple(parte.join(grupos[clave], on=claves, how='semi') for parte in fusionados[clave])
+        estadisticas.append(estadisticas_desde_sketch(tocados, claves, columnas, registro))
+    guardar_sketches(fusionados, version)
+    return estadisticas
 
 def calcular_diferencia_porcentual(df):
     if df is None or df.height == 0:
         print("El dataframe está vacío.")
         return df
     
-    # Obtener las columnas de métricas (todas las columnas excepto Player, Position, Match Day y Estadistica)
-    columnas_metricas = [col for col in df.columns if col not in ['Player', 'Position', 'Team', 'Match Day', 'Estadistica']]
+    # Obtener las columnas de métricas (todas las columnas excepto Week Team, Player, Position, Match Day y Estadistica)
+    columnas_metricas = [col for col in df.columns if col not in ['Week Team', 'Player', 'Position', 'Team', 'Match Day', 'Estadistica']]
     
-    # Crear una copia del dataframe original
-    df_resultado = df.clone()
-    
-    # Para cada combinación de jugador/posición/equipo y estadística
-    # Determinar si el dataframe tiene la columna 'Player', 'Position' o 'Team'
-    tiene_player = 'Player' in df.columns
-    tiene_position = 'Position' in df.columns
-    tiene_team = 'Team' in df.columns
-    
-    # Determinar las columnas de agrupación
-    columnas_agrupacion = []
-    if tiene_player:
-        columnas_agrupacion.append('Player')
-    if tiene_position:
-        columnas_agrupacion.append('Position')
-    if tiene_team:
-        columnas_agrupacion.append('Team')
-    
-    # Añadir 'Estadistica' a las columnas de agrupación
+    # Determinar las columnas de agrupación ('Week Team', 'Player', 'Position' o 'Team' presentes, más 'Estadistica')
+    columnas_agrupacion = [col for col in ['Week Team', 'Player', 'Position', 'Team'] if col in df.columns]
     columnas_agrupacion.append('Estadistica')
     
-    # Para cada combinación de columnas de agrupación y estadística
-    grupos = df.group_by(columnas_agrupacion)
-    
-    # Crear un diccionario para almacenar los valores de referencia (MD) para cada grupo y métrica
-    valores_referencia = {}
-    
-    # Para cada grupo, obtener los valores de referencia (MD)
-    for grupo_valores, grupo_df in grupos:
-        # Verificar si existe el Match Day 'MD' en este grupo
-        if 'MD' not in grupo_df['Match Day'].to_list():
-            continue
-        
-        # Obtener los valores de referencia (MD)
-        df_md = grupo_df.filter(pl.col('Match Day') == 'MD')
-        
-        # Crear una clave para este grupo
-        clave_grupo = tuple(grupo_valores)
-        
-        # Almacenar los valores de referencia para cada métrica
-        valores_referencia[clave_grupo] = {}
-        for columna in columnas_metricas:
-            if columna in df_md.columns:
-                valores_referencia[clave_grupo][columna] = df_md[columna][0]
+    # Fila de referencia (MD) de cada grupo, con las métricas renombradas para el join
+    referencia = (df.lazy()
+                    .filter(pl.col('Match Day') == 'MD')
+                    .unique(subset=columnas_agrupacion, keep='first', maintain_order=True)
+                    .select(columnas_agrupacion + [pl.col(col).alias(f"{col}|MD") for col in columnas_metricas]))
     
-    # Para cada columna de métrica, crear una nueva columna con la diferencia porcentual
+    # Para cada métrica: 0 en el MD, nulo si no hay referencia o es cero, y si no |valor| / |referencia| * 100
+    diferencias = []
     for columna in columnas_metricas:
-        # Nombre de la nueva columna
-        nueva_columna = f"{columna} diff"
-        
-        # Crear una lista para almacenar los valores de diferencia porcentual
-        valores_diff = []
-        
-        # Para cada fila del dataframe
-        for fila in df_resultado.iter_rows(named=True):
-            # Extraer los valores necesarios
-            valores_grupo = {}
-            for col in columnas_agrupacion:
-                valores_grupo[col] = fila[col]
-            match_day = fila['Match Day']
-            
-            # Si la columna no existe en esta fila, añadir None
-            if columna not in fila:
-                valores_diff.append(None)
-                continue
-                
-            valor = fila[columna]
-            
-            # Si es el Match Day de referencia, la diferencia es 0%
-            if match_day == 'MD':
-                valores_diff.append(0.0)
-                continue
-            
-            # Crear la clave para buscar en el diccionario de valores de referencia
-            clave_grupo = tuple(valores_grupo[col] for col in columnas_agrupacion)
-            
-            # Verificar si existe el valor de referencia para este grupo y métrica
-            if clave_grupo not in valores_referencia or columna not in valores_referencia[clave_grupo]:
-                valores_diff.append(None)
-                continue
-            
-            # Obtener el valor de referencia
-            valor_referencia = valores_referencia[clave_grupo][columna]
-            
-            # Si el valor de referencia es cero, no se puede calcular el porcentaje
-            if valor_referencia == 0:
-                valores_diff.append(None)
-                continue
-            
-            # Calcular la diferencia porcentual y redondear a dos decimales
-            diff_porcentual = (abs(valor) / abs(valor_referencia)) * 100
-            valores_diff.append(round(diff_porcentual, 2))
-        
-        # Añadir la nueva columna al dataframe resultado
-        df_resultado = df_resultado.with_columns(pl.Series(nueva_columna, valores_diff))
+        valor_referencia = pl.col(f"{columna}|MD")
+        diferencias.append(
+            pl.when(pl.col('Match Day') == 'MD').then(pl.lit(0.0))
+            .when(valor_referencia.is_null() | (valor_referencia == 0)).then(pl.lit(None, dtype=pl.Float64))
+            .otherwise((pl.col(columna).abs() / valor_referencia.abs() * 100).round(2))
+            .alias(f"{columna} diff")
+        )
     
-    return df_resultado
+    # Unir cada fila con la referencia de su grupo y calcular todas las diferencias en una sola pasada
+    return (df.lazy()
+              .join(referencia, on=columnas_agrupacion, how='left', nulls_equal=True, maintain_order='left')
+              .with_columns(diferencias)
+              .drop([f"{col}|MD" for col in columnas_metricas])
+              .collect())
 
 # df, df1, df2 = calcular_estadisticas("30/11/2023")
 